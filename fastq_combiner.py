@@ -7,8 +7,8 @@ Optimized for Cell Ranger compatibility and large-scale sequencing data.
 
 import os
 import sys
-import gzip
-import glob
+import fnmatch
+import re
 import csv
 import logging
 import argparse
@@ -19,7 +19,7 @@ import hashlib
 import psutil
 import threading
 from pathlib import Path
-from concurrent.futures import ThreadPoolExecutor, as_completed
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor, as_completed
 from typing import Dict, List, Tuple, Optional, Set
 from collections import defaultdict
 import yaml
@@ -37,8 +37,15 @@ import socket
 import getpass
 import html as html_escape
 import multiprocessing
+import mmap
 
 BUFFER_SIZE = 8 * 1024 * 1024  # Default, can be overridden by CLI
+READ_BUFFER_SIZE = 1024 * 1024  # Per-handle buffer for line-by-line FASTQ reads
+MAX_IO_CONCURRENCY = 8  # Concurrent disk readers; IO-bound work slows down past this
+VALIDATE_HEAD_READS = 1000  # Records checked per source by --validate; --validate-full checks them all
+
+# Gate on opening and priming sources in the combine path, sized by set_io_concurrency()
+io_semaphore = threading.BoundedSemaphore(MAX_IO_CONCURRENCY)
 
 # Configure logging
 logging.basicConfig(
@@ -51,6 +58,48 @@ try:
 except ImportError:
     resource = None
 
+try:
+    # ISA-L accelerated DEFLATE; drop-in replacement for the gzip module
+    from isal import igzip as gzip
+    from isal import igzip_threaded
+    GZIP_MAX_LEVEL = 3
+except ImportError:
+    import gzip
+    igzip_threaded = None
+    GZIP_MAX_LEVEL = 9
+
+# isal level 3 compresses about as well as gzip -6 at several times the speed
+OUTPUT_COMPRESSLEVEL = min(6, GZIP_MAX_LEVEL)
+
+try:
+    # SIMD edit-distance scoring for typo-tolerant sample matching
+    from rapidfuzz import fuzz as rffuzz, process as rfprocess
+except ImportError:
+    rffuzz = rfprocess = None
+
+try:
+    # C/SIMD JSON encoder and decoder
+    import orjson
+except ImportError:
+    orjson = None
+
+# Minimum rapidfuzz ratio for a typo match. Long names clear it even when a digit differs
+# (PBMC_Donor_13 vs PBMC_Donor_10), so _best_fuzzy_match also requires identical numbers
+FUZZY_SCORE_CUTOFF = 90
+# The best typo match must beat the runner-up by this much, otherwise the name is ambiguous
+FUZZY_MIN_MARGIN = 5
+
+def set_io_concurrency(threads, io_concurrency=None, semaphore=None):
+    """
+    Size the shared IO semaphore to the disk rather than the CPU count.
+    Defaults to min(threads, 8); pass io_concurrency to override on slow filesystems.
+    Worker processes pass the parent's multiprocessing semaphore so one cap spans the whole pool.
+    """
+    global MAX_IO_CONCURRENCY, io_semaphore
+    MAX_IO_CONCURRENCY = max(1, io_concurrency or min(threads, 8))
+    io_semaphore = semaphore if semaphore is not None else threading.BoundedSemaphore(MAX_IO_CONCURRENCY)
+    return MAX_IO_CONCURRENCY
+
 def read_mapping_file(csv_file):
     """Read CSV mapping file and return dictionary of target -> [source file paths]"""
     mapping = defaultdict(list)
@@ -87,9 +136,38 @@ def read_mapping_file(csv_file):
     logging.info(f"Loaded {len(mapping)} target samples")
     return dict(mapping)
 
+def scan_fastq_tree(search_dir, _ancestors=frozenset()):
+    """
+    Yield (dirpath, filenames) for search_dir and every directory below it, in the order
+    glob's ** visits them, from a single os.scandir pass. Hidden entries are skipped as glob does.
+    """
+    real = os.path.realpath(search_dir)
+    if real in _ancestors:
+        return  # symlink cycle
+    _ancestors = _ancestors | {real}
+    filenames = []
+    subdirs = []
+    try:
+        with os.scandir(search_dir) as it:
+            for entry in it:
+                if entry.name.startswith('.'):
+                    continue
+                try:
+                    if entry.is_dir():
+                        subdirs.append(entry.name)
+                    else:
+                        filenames.append(entry.name)
+                except OSError:
+                    continue
+    except OSError:
+        return
+    yield search_dir, filenames
+    for name in subdirs:
+        yield from scan_fastq_tree(os.path.join(search_dir, name), _ancestors)
+
 def find_fastq_files_fast(search_dirs, r1_patterns=None, r2_patterns=None):
     """
-    Fast file discovery using glob patterns with improved logic
+    Fast file discovery: one directory walk per search dir, with patterns matched in memory
     Returns dict: {sample_base: {'R1': path, 'R2': path}}
     """
     logging.info("\n🔍 Scanning for FASTQ files...")
@@ -115,10 +193,14 @@ def find_fastq_files_fast(search_dirs, r1_patterns=None, r2_patterns=None):
     
     for search_dir in search_dirs:
         logging.info(f"  Scanning: {os.path.abspath(search_dir)}")
+        # Walk once; every pattern below filters this listing instead of re-walking with glob
+        tree = [(os.path.join(dirpath, name), os.path.normcase(name))
+                for dirpath, filenames in scan_fastq_tree(search_dir) for name in filenames]
+        existing = {path for path, _ in tree}
         for r1_pattern in r1_patterns:
-            full_pattern = os.path.join(search_dir, "**", r1_pattern)
-            logging.debug(f"  Looking for pattern: {full_pattern}")
-            r1_files = glob.glob(full_pattern, recursive=True)
+            logging.debug(f"  Looking for pattern: {os.path.join(search_dir, '**', r1_pattern)}")
+            matches = re.compile(fnmatch.translate(os.path.normcase(r1_pattern))).match
+            r1_files = [path for path, name in tree if matches(name)]
             logging.debug(f"  Found R1 files: {r1_files}")
             
             for r1_file in r1_files:
@@ -174,7 +256,7 @@ def find_fastq_files_fast(search_dirs, r1_patterns=None, r2_patterns=None):
                 
                 # Find existing R2 file
                 for r2_candidate in r2_candidates:
-                    if os.path.exists(r2_candidate):
+                    if r2_candidate in existing:
                         r2_file = r2_candidate
                         logging.debug(f"    Found R2 file: {r2_candidate}")
                         break
@@ -209,11 +291,8 @@ def find_fastq_files_fast(search_dirs, r1_patterns=None, r2_patterns=None):
     logging.debug(f"  File pairs: {file_pairs}")
     return file_pairs
 
-def fuzzy_match_sample(sample_name, available_samples):
-    """
-    Fuzzy matching for sample names - handles typos and variations
-    Returns best match or None
-    """
+def _match_sample_by_name(sample_name, available_samples):
+    """Exact, substring and separator-insensitive matching; returns best match or None"""
     sample_name = sample_name.lower().strip()
     
     # Exact match first
@@ -246,30 +325,162 @@ def fuzzy_match_sample(sample_name, available_samples):
     
     return None
 
+def _best_fuzzy_match(sample_name, scored):
+    """
+    Pick a typo match from (candidate, score) pairs that passed FUZZY_SCORE_CUTOFF.
+    Candidates whose numbers differ are never typos but sibling samples (Donor_13 vs Donor_10,
+    Rep1 vs Rep2), so they are dropped; the rest must have a single best score, clear by FUZZY_MIN_MARGIN.
+    """
+    numbers = [int(run) for run in re.findall(r'\d+', sample_name)]
+    ranked = sorted(((score, candidate) for candidate, score in scored
+                     if [int(run) for run in re.findall(r'\d+', candidate)] == numbers),
+                    key=lambda item: item[0], reverse=True)
+    if not ranked:
+        return None
+    if len(ranked) > 1 and ranked[0][0] - ranked[1][0] < FUZZY_MIN_MARGIN:
+        return None
+    return ranked[0][1]
+
+def fuzzy_match_sample(sample_name, available_samples):
+    """
+    Fuzzy matching for sample names - handles typos and variations
+    Returns best match or None
+    """
+    match = _match_sample_by_name(sample_name, available_samples)
+    
+    # Edit-distance matching for typos, scored in C++ across all candidates at once
+    if match is None and rfprocess is not None and available_samples:
+        scored = rfprocess.extract(sample_name.strip(), available_samples, scorer=rffuzz.ratio,
+                                   processor=str.lower, score_cutoff=FUZZY_SCORE_CUTOFF, limit=None)
+        match = _best_fuzzy_match(sample_name, [(candidate, score) for candidate, score, _ in scored])
+    
+    return match
+
+def fuzzy_match_samples(sample_names, available_samples):
+    """
+    Fuzzy-match many sample names at once; returns {sample_name: match} for those that matched.
+    The edit-distance fallback scores every leftover name against every candidate in one
+    rapidfuzz cdist call (multithreaded C++, needs numpy) instead of one extractOne per name.
+    """
+    resolved = {}
+    leftovers = []
+    for sample_name in dict.fromkeys(sample_names):
+        match = _match_sample_by_name(sample_name, available_samples)
+        if match is not None:
+            resolved[sample_name] = match
+        else:
+            leftovers.append(sample_name)
+    
+    if not leftovers or rfprocess is None or not available_samples:
+        return resolved
+    
+    try:
+        scores = rfprocess.cdist([name.strip() for name in leftovers], available_samples, scorer=rffuzz.ratio,
+                                 processor=str.lower, score_cutoff=FUZZY_SCORE_CUTOFF, workers=-1)
+    except ImportError:
+        # cdist returns a numpy matrix; score one name at a time without numpy
+        for sample_name in leftovers:
+            match = fuzzy_match_sample(sample_name, available_samples)
+            if match is not None:
+                resolved[sample_name] = match
+        return resolved
+    
+    for sample_name, row in zip(leftovers, scores):
+        # Scores under the cutoff come back as 0; argmax alone would hide ties and numbered siblings
+        match = _best_fuzzy_match(sample_name, [(available_samples[i], score)
+                                                for i, score in enumerate(row) if score > 0])
+        if match is not None:
+            resolved[sample_name] = match
+    return resolved
+
+def open_fastq_text(fastq_file, buffer_size=READ_BUFFER_SIZE):
+    """
+    Open a plain or gzipped FASTQ for line-by-line text reading.
+    A 1 MiB buffer under the decoder turns thousands of small reads into a few large ones.
+    With isal, gzip inputs are inflated ahead on a background thread while the caller parses.
+    """
+    if str(fastq_file).endswith('.gz'):
+        if igzip_threaded is not None:
+            return igzip_threaded.open(fastq_file, 'rt', threads=1, block_size=buffer_size)
+        return io.TextIOWrapper(io.BufferedReader(gzip.open(fastq_file, 'rb'), buffer_size=buffer_size))
+    return open(fastq_file, 'rt', buffering=buffer_size)
+
+def open_fastq_gated(fastq_file, buffer_size=READ_BUFFER_SIZE):
+    """
+    Open a FASTQ with open_fastq_text under the IO semaphore and fill its first read buffer.
+    The slot is released before the caller parses, so the cap bounds disk readers starting up
+    without serializing the inflate, dedup and deflate work of whole targets.
+    """
+    with io_semaphore:
+        handle = open_fastq_text(fastq_file, buffer_size)
+        try:
+            handle.buffer.peek(1)
+        except BaseException:
+            handle.close()
+            raise
+    return handle
+
+def open_fastq_writer(fileobj, buffer_size=READ_BUFFER_SIZE):
+    """
+    Open a gzip text writer on a binary file object, deflating buffer_size blocks.
+    With isal, deflate and the file writes run on background threads fed by a bounded
+    queue, so compressing one block overlaps parsing the next.
+    """
+    if igzip_threaded is not None:
+        return igzip_threaded.open(fileobj, 'wt', compresslevel=OUTPUT_COMPRESSLEVEL, threads=1,
+                                   block_size=buffer_size)
+    return io.TextIOWrapper(io.BufferedWriter(gzip.open(fileobj, 'wb', compresslevel=OUTPUT_COMPRESSLEVEL),
+                                              buffer_size=buffer_size))
+
+def count_reads_mmap(fastq_file, chunk_size=BUFFER_SIZE):
+    """
+    Count reads in an uncompressed FASTQ by counting newlines in a memory map.
+    The kernel handles paging, so no per-line Python objects are created.
+    """
+    with open(fastq_file, 'rb') as f:
+        size = os.fstat(f.fileno()).st_size
+        if size == 0:
+            return 0
+        with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+            if hasattr(mmap, 'MADV_SEQUENTIAL'):
+                mm.madvise(mmap.MADV_SEQUENTIAL)
+            lines = 0
+            for offset in range(0, size, chunk_size):
+                lines += mm[offset:offset + chunk_size].count(b'\n')
+            # A final record without a trailing newline is still a full record
+            if mm[size - 1] != ord('\n'):
+                lines += 1
+    return lines // 4
+
+def _count_reads(fastq_file):
+    """Count reads in a FASTQ file, raising on read errors"""
+    if not str(fastq_file).endswith('.gz'):
+        return count_reads_mmap(fastq_file)
+    # Count newlines in decompressed binary blocks (memchr in C), like the mmap path,
+    # instead of decoding and iterating every line in Python
+    lines = 0
+    last_byte = b'\n'
+    buf = bytearray(READ_BUFFER_SIZE)
+    with gzip.open(fastq_file, 'rb') as f:
+        while True:
+            n = f.readinto(buf)
+            if not n:
+                break
+            lines += buf.count(b'\n', 0, n)
+            last_byte = buf[n - 1:n]
+    if last_byte != b'\n':
+        lines += 1
+    return lines // 4
+
 def count_reads_fast(fastq_file):
     """
     Fast read counting using streaming - minimal memory usage
     """
-    read_count = 0
     try:
-        # Auto-detect gzip or plain text
-        opener = gzip.open if str(fastq_file).endswith('.gz') else open
-        with opener(fastq_file, 'rt') as f:
-            while True:
-                header = f.readline()
-                if not header:
-                    break
-                seq = f.readline()
-                plus = f.readline()
-                qual = f.readline()
-                if not (seq and plus and qual):
-                    break
-                if header.startswith('@'):
-                    read_count += 1
+        return _count_reads(fastq_file)
     except Exception as e:
         logging.error(f"    Error counting reads in {os.path.basename(fastq_file)}: {e}")
         return 0
-    return read_count
 
 def validate_paired_end_integrity(r1_files, r2_files):
     """Validate that R1 and R2 files have matching read counts"""
@@ -293,26 +504,69 @@ def validate_paired_end_integrity(r1_files, r2_files):
 
 def calculate_file_checksum(file_path):
     """Calculate MD5 checksum of a file"""
-    import hashlib
     hash_md5 = hashlib.md5()
     try:
-        with open(file_path, "rb") as f:
-            for chunk in iter(lambda: f.read(4096), b""):
-                hash_md5.update(chunk)
+        with open(file_path, "rb", buffering=0) as f:
+            if hasattr(hashlib, "file_digest"):
+                # Python 3.11+: C read/hash loop over an unbuffered file
+                return hashlib.file_digest(f, "md5").hexdigest()
+            buf = bytearray(1024 * 1024)
+            view = memoryview(buf)
+            while True:
+                n = f.readinto(buf)
+                if not n:
+                    break
+                hash_md5.update(view[:n])
         return hash_md5.hexdigest()
     except Exception as e:
         logging.warning(f"Could not calculate checksum for {file_path}: {e}")
         return None
 
-def combine_fastq_files_streaming(source_files, output_file, read_type='R1', buffer_size=BUFFER_SIZE, 
+class HashingWriter:
+    """Binary output file that MD5-hashes bytes as they are written, so outputs need no second read for a checksum"""
+    def __init__(self, path):
+        self.fileobj = open(path, 'wb')
+        self.name = path  # keeps the original filename in the gzip header
+        self.hash = hashlib.md5()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def write(self, data):
+        self.hash.update(data)
+        return self.fileobj.write(data)
+
+    def flush(self):
+        self.fileobj.flush()
+
+    def close(self):
+        # The threaded isal writer closes its raw file on error and shutdown paths
+        self.fileobj.close()
+
+    @property
+    def closed(self):
+        return self.fileobj.closed
+
+    def hexdigest(self):
+        return self.hash.hexdigest()
+
+def combine_fastq_files_streaming(source_files, output_file, read_type='R1', buffer_size=READ_BUFFER_SIZE, 
                                 validate=False, check_barcodes=False, gc_analysis=False, adapter_check=False,
-                                create_backups=False, deduplicate=False, paired_end_dedup=False, mate_files=None):
+                                create_backups=False, deduplicate=False, paired_end_dedup=False, mate_files=None,
+                                checksums=None):
     """
     Combine multiple FASTQ files using streaming I/O with enhanced validation and optional deduplication.
     If paired_end_dedup is True, deduplicate based on (R1, R2) sequence pairs.
     - For single-end: source_files is a list of file paths.
     - For paired-end: source_files is a list of (R1, R2) tuples, and output_file is (R1_out, R2_out).
+    validate is False, True (check the first VALIDATE_HEAD_READS records of each source) or 'full'.
+    MD5s of the written outputs are stored in checksums (a dict keyed by output path) when one is given.
     """
+    if checksums is None:
+        checksums = {}
     total_reads = 0
     total_size = 0
     validation_warnings = []
@@ -325,11 +579,10 @@ def combine_fastq_files_streaming(source_files, output_file, read_type='R1', buf
         # Paired-end deduplication: source_files is a list of (R1, R2) tuples, output_file is (R1_out, R2_out)
         seen_pairs = set()
         r1_out, r2_out = output_file
-        with gzip.open(r1_out, 'wt') as out1, gzip.open(r2_out, 'wt') as out2:
+        with HashingWriter(r1_out) as hashed1, HashingWriter(r2_out) as hashed2, \
+             open_fastq_writer(hashed1, buffer_size) as out1, open_fastq_writer(hashed2, buffer_size) as out2:
             for r1_file, r2_file in source_files:
-                opener1 = gzip.open if r1_file.endswith('.gz') else open
-                opener2 = gzip.open if r2_file.endswith('.gz') else open
-                with opener1(r1_file, 'rt') as in1, opener2(r2_file, 'rt') as in2:
+                with open_fastq_gated(r1_file, buffer_size) as in1, open_fastq_gated(r2_file, buffer_size) as in2:
                     while True:
                         h1 = in1.readline()
                         s1 = in1.readline()
@@ -361,9 +614,9 @@ def combine_fastq_files_streaming(source_files, output_file, read_type='R1', buf
                         out2.write(s2)
                         out2.write(p2)
                         out2.write(q2)
-        # Calculate checksums for both outputs
-        checksum1 = calculate_file_checksum(r1_out)
-        checksum2 = calculate_file_checksum(r2_out)
+        # Checksums were computed as the compressed bytes were written
+        checksum1 = checksums[r1_out] = hashed1.hexdigest()
+        checksum2 = checksums[r2_out] = hashed2.hexdigest()
         if checksum1:
             logging.info(f"Output file checksum (R1): {checksum1}")
         if checksum2:
@@ -376,16 +629,16 @@ def combine_fastq_files_streaming(source_files, output_file, read_type='R1', buf
             logging.info(f"Using in-memory deduplication (max {max_sequences:,} sequences)")
         else:
             seen_sequences = None
-        with gzip.open(output_file, 'wt') as outfile:
+        with HashingWriter(output_file) as hashed, open_fastq_writer(hashed, buffer_size) as outfile:
             for i, source_file in enumerate(source_files, 1):
                 file_size = os.path.getsize(source_file)
                 total_size += file_size
                 if validate:
-                    file_warnings = validate_fastq_quality(source_file)
+                    file_warnings = validate_fastq_quality(
+                        source_file, max_reads=None if validate == 'full' else VALIDATE_HEAD_READS)
                     if file_warnings:
                         validation_warnings.extend([f"{source_file}: {w}" for w in file_warnings])
-                opener = gzip.open if source_file.endswith('.gz') else open
-                with opener(source_file, 'rt') as infile:
+                with open_fastq_gated(source_file, buffer_size) as infile:
                     while True:
                         header = infile.readline()
                         if not header:
@@ -419,7 +672,7 @@ def combine_fastq_files_streaming(source_files, output_file, read_type='R1', buf
                         outfile.write(sequence)
                         outfile.write(plus)
                         outfile.write(quality)
-        checksum = calculate_file_checksum(output_file)
+        checksum = checksums[output_file] = hashed.hexdigest()
         if checksum:
             logging.info(f"Output file checksum ({read_type}): {checksum}")
         if validation_warnings:
@@ -442,6 +695,15 @@ def sanitize_sample_name(sample_name):
     sanitized = ''.join(c for c in sanitized if c.isalnum() or c in '_-')
     return sanitized
 
+def cached_stat(path, stat_cache):
+    """os.stat() memoized in stat_cache; returns None for missing files"""
+    if path not in stat_cache:
+        try:
+            stat_cache[path] = os.stat(path)
+        except OSError:
+            stat_cache[path] = None
+    return stat_cache[path]
+
 def get_memory_usage():
     """Get current memory usage in MB"""
     process = psutil.Process(os.getpid())
@@ -468,6 +730,24 @@ def detect_storage_type(path):
     except Exception:
         return 'Unknown'
 
+def get_available_cpus():
+    """CPUs this process may run on (respects taskset/cgroup affinity on Linux)"""
+    if hasattr(os, 'sched_getaffinity'):
+        return len(os.sched_getaffinity(0))
+    return os.cpu_count() or 1
+
+def auto_tune_workers(target_count, threads=None, buffer_size=None):
+    """
+    Fill in unset worker count and buffer size.
+    Threads default to min(CPUs, targets). The buffer is per open reader/writer (the threaded
+    isal streams queue several blocks each), so it stays at READ_BUFFER_SIZE rather than growing with RAM.
+    """
+    if not threads:
+        threads = max(1, min(get_available_cpus(), target_count))
+    if not buffer_size:
+        buffer_size = READ_BUFFER_SIZE
+    return threads, buffer_size
+
 def optimize_batch_size(available_ram_mb, storage_type, file_count):
     """Optimize batch size based on system resources"""
     base_size = 8 * 1024 * 1024  # 8MB base
@@ -518,6 +798,29 @@ def clear_checkpoint(output_dir):
     if os.path.exists(checkpoint_path):
         os.remove(checkpoint_path)
 
+def write_output_meta(output_file, checksum):
+    """Record an output's checksum in a .meta.json sidecar so reruns need not re-read it"""
+    try:
+        st = os.stat(output_file)
+        meta = {'md5': checksum, 'size': st.st_size, 'mtime_ns': st.st_mtime_ns}
+        with open(output_file + '.meta.json', 'wb') as f:
+            f.write(orjson.dumps(meta) if orjson is not None else json.dumps(meta).encode())
+    except OSError as e:
+        logging.debug(f"Could not write metadata for {output_file}: {e}")
+
+def read_output_meta(output_file):
+    """Return an output's sidecar metadata if its size and mtime still match the file, else None"""
+    try:
+        st = os.stat(output_file)
+        with open(output_file + '.meta.json', 'rb') as f:
+            data = f.read()
+        meta = orjson.loads(data) if orjson is not None else json.loads(data)
+    except (OSError, ValueError):
+        return None
+    if meta.get('size') != st.st_size or meta.get('mtime_ns') != st.st_mtime_ns:
+        return None
+    return meta
+
 def detect_quality_format(quality_line):
     """Detect FASTQ quality score format from quality line"""
     if not quality_line:
@@ -540,14 +843,16 @@ def detect_quality_format(quality_line):
     else:
         return 'unknown'
 
-def validate_fastq_quality(fastq_file):
-    """Validate FASTQ file quality and detect corruption with format detection"""
+def validate_fastq_quality(fastq_file, max_reads=None):
+    """
+    Validate FASTQ file quality and detect corruption with format detection.
+    Only the first max_reads records are checked when it is given; the format shows in the first few.
+    """
     warnings = []
     quality_formats = set()
     
     try:
-        opener = gzip.open if fastq_file.endswith('.gz') else open
-        with opener(fastq_file, 'rt') as f:
+        with open_fastq_text(fastq_file) as f:
             line_count = 0
             read_count = 0
             lengths = []
@@ -587,6 +892,8 @@ def validate_fastq_quality(fastq_file):
                         warnings.append(f"Unknown quality score format at read {read_count}")
                     
                     quality_lines.append(line)
+                    if max_reads is not None and read_count >= max_reads:
+                        break
             
             if line_count % 4 != 0:
                 warnings.append("Incomplete FASTQ file")
@@ -732,7 +1039,8 @@ def generate_html_report(output_dir, mapping, file_pairs, combination_stats, mis
         avg_read_length_str = "N/A"
     # HTML content
     html_path = os.path.join(output_dir, "combination_report.html")
-    html_content = f"""
+    with open(html_path, 'w', buffering=1 << 20) as f:
+        f.write(f"""
 <!DOCTYPE html>
 <html lang=\"en\">
 <head>
@@ -777,11 +1085,11 @@ def generate_html_report(output_dir, mapping, file_pairs, combination_stats, mis
         </div>
         <div class=\"section\">
             <h2>🛠️ System & Run Metadata</h2>
-            <table>"""
-    for k, v in metadata.items():
-        html_content += f"<tr><th>{html_escape.escape(str(k))}</th><td>{html_escape.escape(str(v))}</td></tr>"
-    html_content += "</table></div>"
-    html_content += f"""
+            <table>""")
+        for k, v in metadata.items():
+            f.write(f"<tr><th>{html_escape.escape(str(k))}</th><td>{html_escape.escape(str(v))}</td></tr>")
+        f.write("</table></div>")
+        f.write(f"""
         <div class=\"summary-grid\">
             <div class=\"summary-card\"><h3>{total_targets:,}</h3><p>Target Samples</p></div>
             <div class=\"summary-card\"><h3>{successful_combinations:,}</h3><p>Successful</p></div>
@@ -825,88 +1133,78 @@ def generate_html_report(output_dir, mapping, file_pairs, combination_stats, mis
                     <th>Status</th>
                     <th>Details</th>
                 </tr>
-    """
-    for target, source_paths in mapping.items():
-        clean_target = sanitize_sample_name(target)
-        details_id = f"details_{clean_target}"
-        status_class = "success" if target in combination_stats else "failed"
-        if target in combination_stats:
-            stats = combination_stats[target]
-            status = f'<span class="success">✓ Success</span>'
-            total_reads = f'{stats["total_reads"]:,}'
-            # Show what sources were matched
-            matched_sources = []
-            for source_path in source_paths:
-                if source_path in fuzzy_matches:
-                    original, matched = fuzzy_matches[source_path]
-                    matched_sources.append(f'"{original}" → {os.path.basename(matched)} <span class="warning">(fuzzy)</span>')
-                else:
-                    matched_sources.append(f'{source_path} <span class="success">(exact)</span>')
-            source_matches = "<br>".join(matched_sources)
-            cell_ranger_files = f'<a href="{clean_target}_S1_R1_001.fastq.gz">{clean_target}_S1_R1_001.fastq.gz</a><br><a href="{clean_target}_S1_R2_001.fastq.gz">{clean_target}_S1_R2_001.fastq.gz</a>'
-        else:
-            status = f'<span class="error">✗ Failed</span>'
-            total_reads = "0"
-            source_matches = "No matches found"
-            cell_ranger_files = "Not generated"
-        html_content += f"""
-                <tr class=\"row {status_class}\" data-target=\"{target}\" data-status=\"{status_class}\">
-                    <td><strong>{target}</strong></td>
+    """)
+        # Sample names and paths come from user files, so escape them before they reach the markup
+        esc = html_escape.escape
+        for target, source_paths in mapping.items():
+            clean_target = sanitize_sample_name(target)
+            details_id = f"details_{clean_target}"
+            status_class = "success" if target in combination_stats else "failed"
+            if target in combination_stats:
+                stats = combination_stats[target]
+                status = f'<span class="success">✓ Success</span>'
+                total_reads = f'{stats["total_reads"]:,}'
+                # Show what sources were matched
+                matched_sources = []
+                for source_path in source_paths:
+                    if source_path in fuzzy_matches:
+                        original, matched = fuzzy_matches[source_path]
+                        matched_sources.append(f'"{esc(original)}" → {esc(os.path.basename(matched))} <span class="warning">(fuzzy)</span>')
+                    else:
+                        matched_sources.append(f'{esc(source_path)} <span class="success">(exact)</span>')
+                source_matches = "<br>".join(matched_sources)
+                cell_ranger_files = f'<a href="{clean_target}_S1_R1_001.fastq.gz">{clean_target}_S1_R1_001.fastq.gz</a><br><a href="{clean_target}_S1_R2_001.fastq.gz">{clean_target}_S1_R2_001.fastq.gz</a>'
+            else:
+                status = f'<span class="error">✗ Failed</span>'
+                total_reads = "0"
+                source_matches = "No matches found"
+                cell_ranger_files = "Not generated"
+            f.write(f"""
+                <tr class=\"row {status_class}\" data-target=\"{esc(target)}\" data-status=\"{status_class}\">
+                    <td><strong>{esc(target)}</strong></td>
                     <td class="filepath">{cell_ranger_files}</td>
                     <td>{source_matches}</td>
                     <td>{total_reads}</td>
                     <td>{status}</td>
                     <td><button class='collapsible'>Show Details</button><div class='content' id='{details_id}'>
-        """
-        # Per-source file details
-        if target in combination_stats:
-            html_content += "<table><tr><th>Source File</th><th>Type</th><th>Size (MB)</th><th>Read Count</th><th>Match</th><th>Warnings</th></tr>"
-            for s in combination_stats[target]['source_files']:
-                for read_type in ['R1', 'R2']:
-                    fpath = file_pairs[s][read_type]
-                    ftype = read_type
-                    try:
-                        size_mb = os.path.getsize(fpath) / 1024 / 1024
-                    except Exception:
-                        size_mb = 'N/A'
-                    try:
-                        opener = gzip.open if fpath.endswith('.gz') else open
-                        with opener(fpath, 'rt') as f:
-                            count = 0
-                            while True:
-                                header = f.readline()
-                                if not header:
-                                    break
-                                seq = f.readline()
-                                plus = f.readline()
-                                qual = f.readline()
-                                if header.startswith('@') and seq and plus and qual:
-                                    count += 1
-                        read_count = count
-                    except Exception:
-                        read_count = 'N/A'
-                    match_type = 'Fuzzy' if s in fuzzy_matches else 'Exact'
-                    warnings = []
-                    if read_count == 'N/A':
-                        warnings.append('Unreadable')
-                    if size_mb == 'N/A':
-                        warnings.append('Missing')
-                    html_content += f"<tr><td class='filepath'>{fpath}</td><td>{ftype}</td><td>{size_mb}</td><td>{read_count}</td><td>{match_type}</td><td>{', '.join(warnings) if warnings else '-'}</td></tr>"
-            html_content += "</table>"
-        html_content += "</div></td></tr>"
-    html_content += """
+        """)
+            # Per-source file details
+            if target in combination_stats:
+                f.write("<table><tr><th>Source File</th><th>Type</th><th>Size (MB)</th><th>Read Count</th><th>Match</th><th>Warnings</th></tr>")
+                for s in combination_stats[target]['source_files']:
+                    for read_type in ['R1', 'R2']:
+                        fpath = file_pairs[s][read_type]
+                        ftype = read_type
+                        try:
+                            size_mb = os.path.getsize(fpath) / 1024 / 1024
+                        except Exception:
+                            size_mb = 'N/A'
+                        try:
+                            read_count = _count_reads(fpath)
+                        except Exception:
+                            read_count = 'N/A'
+                        match_type = 'Fuzzy' if s in fuzzy_matches else 'Exact'
+                        warnings = []
+                        if read_count == 'N/A':
+                            warnings.append('Unreadable')
+                        if size_mb == 'N/A':
+                            warnings.append('Missing')
+                        f.write(f"<tr><td class='filepath'>{esc(fpath)}</td><td>{ftype}</td><td>{size_mb}</td><td>{read_count}</td><td>{match_type}</td><td>{', '.join(warnings) if warnings else '-'}</td></tr>")
+                f.write("</table>")
+            f.write("</div></td></tr>")
+        f.write("""
             </table>
         </div>
-    """
-    # Skipped/failed samples
-    if failed_samples:
-        html_content += f"<div class='section'><h2>❌ Skipped/Failed Samples</h2><table><tr><th>Target</th><th>Reason</th></tr>"
-        for target, reason in failed_samples:
-            html_content += f"<tr><td>{target}</td><td>{reason}</td></tr>"
-        html_content += "</table></div>"
-    # Fuzzy matches
-    if fuzzy_matches:
-        html_content += f"""
+    """)
+        # Skipped/failed samples
+        if failed_samples:
+            f.write(f"<div class='section'><h2>❌ Skipped/Failed Samples</h2><table><tr><th>Target</th><th>Reason</th></tr>")
+            for target, reason in failed_samples:
+                f.write(f"<tr><td>{esc(target)}</td><td>{esc(str(reason))}</td></tr>")
+            f.write("</table></div>")
+        # Fuzzy matches
+        if fuzzy_matches:
+            f.write(f"""
         <div class="section">
             <h2>🎯 Fuzzy Matches Applied</h2>
             <p>The following sample names were automatically corrected:</p>
@@ -916,22 +1214,22 @@ def generate_html_report(output_dir, mapping, file_pairs, combination_stats, mis
                     <th>Matched To</th>
                     <th>Confidence</th>
                 </tr>
-        """
-        for source_path, (original, matched) in fuzzy_matches.items():
-            confidence = "High" if original.lower() in matched.lower() else "Medium"
-            html_content += f"""
+        """)
+            for source_path, (original, matched) in fuzzy_matches.items():
+                confidence = "High" if original.lower() in matched.lower() else "Medium"
+                f.write(f"""
                 <tr>
-                    <td class="filepath">{original}</td>
-                    <td class="filepath">{matched}</td>
+                    <td class="filepath">{esc(original)}</td>
+                    <td class="filepath">{esc(matched)}</td>
                     <td><span class="warning">{confidence}</span></td>
                 </tr>
-            """
-        html_content += """
+            """)
+            f.write("""
             </table>
         </div>
-        """
-    # JS for collapsible sections, search/filter, and charts
-    html_content += """
+        """)
+        # JS for collapsible sections, search/filter, and charts
+        f.write("""
     <script>
     // Collapsible sections
     var coll = document.getElementsByClassName("collapsible");
@@ -998,9 +1296,9 @@ def generate_html_report(output_dir, mapping, file_pairs, combination_stats, mis
         data: {
           labels: ['Successful', 'Failed'],
           datasets: [{
-            data: ["""
-    html_content += f"{successful_combinations}, {len(failed_samples)}"
-    html_content += """],
+            data: [""")
+        f.write(f"{successful_combinations}, {len(failed_samples)}")
+        f.write("""],
             backgroundColor: ['#4CAF50', '#f44336'],
             borderWidth: 2,
             borderColor: '#fff'
@@ -1021,28 +1319,28 @@ def generate_html_report(output_dir, mapping, file_pairs, combination_stats, mis
       var readChart = new Chart(readCtx, {
         type: 'bar',
         data: {
-          labels: ["""
-    # Get read counts for successful samples
-    read_counts = []
-    for target in mapping:
-        if target in combination_stats:
-            read_counts.append(combination_stats[target]['total_reads'])
-    
-    # Format labels and data for chart
-    if read_counts:
-        labels_str = f"'{', '.join(str(x) for x in read_counts[:10])}'"  # Limit to first 10
-        data_str = f"{', '.join(str(x) for x in read_counts[:10])}"
-    else:
-        labels_str = "'No data'"
-        data_str = "0"
+          labels: [""")
+        # Get read counts for successful samples
+        read_counts = []
+        for target in mapping:
+            if target in combination_stats:
+                read_counts.append(combination_stats[target]['total_reads'])
+    
+        # Format labels and data for chart
+        if read_counts:
+            labels_str = f"'{', '.join(str(x) for x in read_counts[:10])}'"  # Limit to first 10
+            data_str = f"{', '.join(str(x) for x in read_counts[:10])}"
+        else:
+            labels_str = "'No data'"
+            data_str = "0"
     
-    html_content += f"{labels_str}"
-    html_content += """],
+        f.write(f"{labels_str}")
+        f.write("""],
           datasets: [{
             label: 'Read Count',
-            data: ["""
-    html_content += f"{data_str}"
-    html_content += """],
+            data: [""")
+        f.write(f"{data_str}")
+        f.write("""],
             backgroundColor: '#2196F3',
             borderColor: '#1976D2',
             borderWidth: 1
@@ -1074,8 +1372,8 @@ def generate_html_report(output_dir, mapping, file_pairs, combination_stats, mis
       });
     });
     </script>
-    """
-    html_content += f"""
+    """)
+        f.write(f"""
         <div class="footer" style="text-align: center; margin-top: 40px; color: #666;">
             <p><strong>⚡ OPTIMIZED FOR SPEED!</strong> Streaming I/O with minimal RAM usage</p>
             <p><strong>Cell Ranger Ready!</strong> All output files follow Illumina naming convention</p>
@@ -1084,16 +1382,147 @@ def generate_html_report(output_dir, mapping, file_pairs, combination_stats, mis
     </div>
 </body>
 </html>
-    """
-    with open(html_path, 'w') as f:
-        f.write(html_content)
+    """)
+    # Large reports also get a gzipped sibling; browsers inflate it transparently
+    if os.path.getsize(html_path) > 1 << 20:
+        with open(html_path, 'rb') as src, gzip.open(html_path + '.gz', 'wb', compresslevel=1) as dst:
+            shutil.copyfileobj(src, dst, BUFFER_SIZE)
     return html_path
 
+def process_target(target, matched_sources, paired_end_dedup, file_pairs, output_dir, force=False,
+                   buffer_size=READ_BUFFER_SIZE, validate=False, check_barcodes=False, gc_analysis=False,
+                   adapter_check=False, create_backups=False, deduplicate=False, total_size=None):
+    """
+    Combine all sources of one target into its Cell Ranger R1/R2 pair.
+    Module-level (not a closure) so ProcessPoolExecutor can pickle it.
+    total_size (bytes of all sources) may be passed in from an existing stat pass.
+    """
+    logging.info(f"\n🔗 Processing target: {target}")
+    clean_target = sanitize_sample_name(target)
+    logging.info(f"  📁 Combining {len(matched_sources)} files")
+    logging.info(f"  📝 Cell Ranger format: {clean_target}_S1_R*_001.fastq.gz")
+    logging.info(f"  ⚡ Using streaming I/O for maximum speed...")
+    
+    start_time = datetime.now()
+    pair_cache = [file_pairs[s] for s in matched_sources]
+    r1_sources = [pair['R1'] for pair in pair_cache]
+    r1_output = os.path.join(output_dir, f"{clean_target}_S1_R1_001.fastq.gz")
+    r2_sources = [pair['R2'] for pair in pair_cache]
+    r2_output = os.path.join(output_dir, f"{clean_target}_S1_R2_001.fastq.gz")
+    
+    # Validate paired-end integrity before processing
+    logging.info(f"  🔍 Validating paired-end integrity...")
+    mismatches = validate_paired_end_integrity(r1_sources, r2_sources)
+    if mismatches:
+        logging.warning(f"  ⚠️  Paired-end mismatches detected:")
+        for r1_file, r1_count, r2_file, r2_count in mismatches:
+            logging.warning(f"    {os.path.basename(r1_file)}: {r1_count:,} vs {os.path.basename(r2_file)}: {r2_count:,}")
+        if not force:
+            logging.error(f"  ❌ Skipping {target} due to paired-end mismatches. Use --force to proceed.")
+            return {
+                'target': target,
+                'source_files': matched_sources,
+                'total_reads': 0,
+                'r1_output': r1_output,
+                'r2_output': r2_output,
+                'clean_name': clean_target,
+                'processing_time': 0,
+                'speed_mb_per_sec': 0,
+                'skipped': True,
+                'error': 'paired_end_mismatch'
+            }
+    
+    # Overwrite protection
+    if not force:
+        if os.path.exists(r1_output) or os.path.exists(r2_output):
+            logging.warning(f"  Skipping {target}: output files already exist. Use --force to overwrite.")
+            # Reuse checksums recorded by the run that wrote these outputs instead of re-hashing them
+            r1_meta = read_output_meta(r1_output) or {}
+            r2_meta = read_output_meta(r2_output) or {}
+            return {
+                'target': target,
+                'source_files': matched_sources,
+                'total_reads': 0,
+                'r1_output': r1_output,
+                'r2_output': r2_output,
+                'clean_name': clean_target,
+                'processing_time': 0,
+                'speed_mb_per_sec': 0,
+                'skipped': True,
+                'error': 'files_exist',
+                'r1_checksum': r1_meta.get('md5'),
+                'r2_checksum': r2_meta.get('md5')
+            }
+    
+    # Process with error recovery
+    checksums = {}
+    try:
+        if paired_end_dedup:
+            # Pass zipped tuples for paired-end deduplication
+            paired_sources = list(zip(r1_sources, r2_sources))
+            r1_reads = combine_fastq_files_streaming(paired_sources, (r1_output, r2_output), 'R1', buffer_size, validate, check_barcodes, gc_analysis, adapter_check, create_backups, deduplicate, paired_end_dedup, checksums=checksums)
+            r2_reads = r1_reads  # Both outputs should have the same number of reads
+        else:
+            r1_reads = combine_fastq_files_streaming(r1_sources, r1_output, 'R1', buffer_size, validate, check_barcodes, gc_analysis, adapter_check, create_backups, deduplicate, paired_end_dedup, checksums=checksums)
+            r2_reads = combine_fastq_files_streaming(r2_sources, r2_output, 'R2', buffer_size, validate, check_barcodes, gc_analysis, adapter_check, create_backups, deduplicate, paired_end_dedup, checksums=checksums)
+    except Exception as e:
+        logging.error(f"  ❌ Error processing {target}: {e}")
+        # Clean up partial outputs
+        for output_file in [r1_output, r2_output, r1_output + '.meta.json', r2_output + '.meta.json']:
+            if os.path.exists(output_file):
+                os.remove(output_file)
+        return {
+            'target': target,
+            'source_files': matched_sources,
+            'total_reads': 0,
+            'r1_output': r1_output,
+            'r2_output': r2_output,
+            'clean_name': clean_target,
+            'processing_time': 0,
+            'speed_mb_per_sec': 0,
+            'skipped': True,
+            'error': str(e)
+        }
+    
+    write_output_meta(r1_output, checksums.get(r1_output))
+    write_output_meta(r2_output, checksums.get(r2_output))
+    
+    end_time = datetime.now()
+    duration = (end_time - start_time).total_seconds()
+    if total_size is None:
+        total_size = sum(os.path.getsize(pair['R1']) + os.path.getsize(pair['R2']) for pair in pair_cache)
+    speed_mb_per_sec = (total_size / 1024 / 1024) / duration if duration > 0 else 0
+    
+    if r1_reads != r2_reads:
+        logging.warning(f"  ⚠️  Warning: R1 ({r1_reads:,}) and R2 ({r2_reads:,}) read counts don't match!")
+    
+    result = {
+        'target': target,
+        'source_files': matched_sources,
+        'total_reads': r1_reads,
+        'r2_reads': r2_reads,
+        'r1_output': r1_output,
+        'r2_output': r2_output,
+        'clean_name': clean_target,
+        'processing_time': duration,
+        'speed_mb_per_sec': speed_mb_per_sec,
+        'skipped': False,
+        'paired_end_mismatches': len(mismatches) if mismatches else 0,
+        'r1_checksum': checksums.get(r1_output),
+        'r2_checksum': checksums.get(r2_output)
+    }
+    
+    logging.info(f"  ✅ {clean_target}: {r1_reads:,} read pairs")
+    logging.info(f"  ⚡ Speed: {speed_mb_per_sec:.1f} MB/sec ({duration:.1f} seconds)")
+    
+    return result
+
 def combine_fastq_files_main(csv_file, output_dir="combined", search_dirs=None, dry_run=False, force=False, 
-                           r1_patterns=None, r2_patterns=None, threads=4, buffer_size=BUFFER_SIZE,
+                           r1_patterns=None, r2_patterns=None, threads=None, buffer_size=None,
                            validate=False, check_barcodes=False, gc_analysis=False, adapter_check=False,
                            create_backups=False, retry_failed=False, real_time_monitor=False,
-                           checkpoint=False, no_html=False, no_csv=False, deduplicate=False):
+                           checkpoint=False, no_html=False, no_csv=False, deduplicate=False,
+                           io_concurrency=None, executor_type='auto'):
     """Main function with streaming optimizations"""
     
     logging.info("⚡ FASTQ File Combiner - STREAMING OPTIMIZED")
@@ -1126,6 +1555,10 @@ def combine_fastq_files_main(csv_file, output_dir="combined", search_dirs=None,
     fuzzy_matches = {}
     final_mapping = {}
     
+    # Resolve every source that is not an exact key in one batch
+    unmatched = [s for source_paths in mapping.values() for s in source_paths if s not in file_pairs]
+    resolved = fuzzy_match_samples(unmatched, available_samples)
+    
     for target, source_paths in mapping.items():
         logging.info(f"\n  Target: {target}")
         matched_sources = []
@@ -1137,7 +1570,7 @@ def combine_fastq_files_main(csv_file, output_dir="combined", search_dirs=None,
                 logging.info(f"    ✓ {source_path} (exact match)")
             else:
                 # Try fuzzy matching
-                fuzzy_match = fuzzy_match_sample(source_path, available_samples)
+                fuzzy_match = resolved.get(source_path)
                 if fuzzy_match:
                     matched_sources.append(fuzzy_match)
                     fuzzy_matches[source_path] = (source_path, fuzzy_match)
@@ -1155,14 +1588,21 @@ def combine_fastq_files_main(csv_file, output_dir="combined", search_dirs=None,
         return
     
     # Validate all source files exist and are readable
+    # One stat per unique path, even when targets share sources
     missing_files = []
     invalid_targets = set()
+    stat_cache = {}
+    readable = {}
     for target, matched_sources in final_mapping.items():
         for s in matched_sources:
+            pair = file_pairs[s]
             for read_type in ['R1', 'R2']:
-                fpath = file_pairs[s][read_type]
-                if not os.path.exists(fpath) or not os.access(fpath, os.R_OK):
-                    missing_files.append(fpath)
+                fpath = pair[read_type]
+                if fpath not in readable:
+                    readable[fpath] = cached_stat(fpath, stat_cache) is not None and os.access(fpath, os.R_OK)
+                    if not readable[fpath]:
+                        missing_files.append(fpath)
+                if not readable[fpath]:
                     invalid_targets.add(target)
     if missing_files:
         logging.error(f"Missing or unreadable files detected: {len(missing_files)}")
@@ -1181,6 +1621,10 @@ def combine_fastq_files_main(csv_file, output_dir="combined", search_dirs=None,
         if target in final_mapping:
             del final_mapping[target]
     
+    threads, buffer_size = auto_tune_workers(len(final_mapping), threads, buffer_size)
+    logging.info(f"Threads: {threads} | Buffer size: {buffer_size / 1024 / 1024:g} MiB | "
+                 f"IO concurrency: {set_io_concurrency(threads, io_concurrency)}")
+    
     # Create output directory
     os.makedirs(output_dir, exist_ok=True)
     logging.info(f"\nCreated output directory: {os.path.abspath(output_dir)}")
@@ -1188,124 +1632,20 @@ def combine_fastq_files_main(csv_file, output_dir="combined", search_dirs=None,
     # Perform combinations with Cell Ranger naming - STREAMING MODE
     combination_stats = {}
 
-    def process_target(target, matched_sources, paired_end_dedup):
-        logging.info(f"\n🔗 Processing target: {target}")
-        clean_target = sanitize_sample_name(target)
-        logging.info(f"  📁 Combining {len(matched_sources)} files")
-        logging.info(f"  📝 Cell Ranger format: {clean_target}_S1_R*_001.fastq.gz")
-        logging.info(f"  ⚡ Using streaming I/O for maximum speed...")
-        
-        start_time = datetime.now()
-        r1_sources = [file_pairs[s]['R1'] for s in matched_sources]
-        r1_output = os.path.join(output_dir, f"{clean_target}_S1_R1_001.fastq.gz")
-        r2_sources = [file_pairs[s]['R2'] for s in matched_sources]
-        r2_output = os.path.join(output_dir, f"{clean_target}_S1_R2_001.fastq.gz")
-        
-        # Validate paired-end integrity before processing
-        logging.info(f"  🔍 Validating paired-end integrity...")
-        mismatches = validate_paired_end_integrity(r1_sources, r2_sources)
-        if mismatches:
-            logging.warning(f"  ⚠️  Paired-end mismatches detected:")
-            for r1_file, r1_count, r2_file, r2_count in mismatches:
-                logging.warning(f"    {os.path.basename(r1_file)}: {r1_count:,} vs {os.path.basename(r2_file)}: {r2_count:,}")
-            if not force:
-                logging.error(f"  ❌ Skipping {target} due to paired-end mismatches. Use --force to proceed.")
-                return {
-                    'target': target,
-                    'source_files': matched_sources,
-                    'total_reads': 0,
-                    'r1_output': r1_output,
-                    'r2_output': r2_output,
-                    'clean_name': clean_target,
-                    'processing_time': 0,
-                    'speed_mb_per_sec': 0,
-                    'skipped': True,
-                    'error': 'paired_end_mismatch'
-                }
-        
-        # Overwrite protection
-        if not force:
-            if os.path.exists(r1_output) or os.path.exists(r2_output):
-                logging.warning(f"  Skipping {target}: output files already exist. Use --force to overwrite.")
-                return {
-                    'target': target,
-                    'source_files': matched_sources,
-                    'total_reads': 0,
-                    'r1_output': r1_output,
-                    'r2_output': r2_output,
-                    'clean_name': clean_target,
-                    'processing_time': 0,
-                    'speed_mb_per_sec': 0,
-                    'skipped': True,
-                    'error': 'files_exist'
-                }
-        
-        # Process with error recovery
-        try:
-            if paired_end_dedup:
-                # Pass zipped tuples for paired-end deduplication
-                paired_sources = list(zip(r1_sources, r2_sources))
-                r1_reads = combine_fastq_files_streaming(paired_sources, (r1_output, r2_output), 'R1', buffer_size, validate, check_barcodes, gc_analysis, adapter_check, create_backups, deduplicate, paired_end_dedup)
-                r2_reads = r1_reads  # Both outputs should have the same number of reads
-            else:
-                r1_reads = combine_fastq_files_streaming(r1_sources, r1_output, 'R1', buffer_size, validate, check_barcodes, gc_analysis, adapter_check, create_backups, deduplicate, paired_end_dedup)
-                r2_reads = combine_fastq_files_streaming(r2_sources, r2_output, 'R2', buffer_size, validate, check_barcodes, gc_analysis, adapter_check, create_backups, deduplicate, paired_end_dedup)
-        except Exception as e:
-            logging.error(f"  ❌ Error processing {target}: {e}")
-            # Clean up partial outputs
-            for output_file in [r1_output, r2_output]:
-                if os.path.exists(output_file):
-                    os.remove(output_file)
-            return {
-                'target': target,
-                'source_files': matched_sources,
-                'total_reads': 0,
-                'r1_output': r1_output,
-                'r2_output': r2_output,
-                'clean_name': clean_target,
-                'processing_time': 0,
-                'speed_mb_per_sec': 0,
-                'skipped': True,
-                'error': str(e)
-            }
-        
-        end_time = datetime.now()
-        duration = (end_time - start_time).total_seconds()
-        total_size = sum(os.path.getsize(file_pairs[s]['R1']) + os.path.getsize(file_pairs[s]['R2']) for s in matched_sources)
-        speed_mb_per_sec = (total_size / 1024 / 1024) / duration if duration > 0 else 0
-        
-        if r1_reads != r2_reads:
-            logging.warning(f"  ⚠️  Warning: R1 ({r1_reads:,}) and R2 ({r2_reads:,}) read counts don't match!")
-        
-        result = {
-            'target': target,
-            'source_files': matched_sources,
-            'total_reads': r1_reads,
-            'r2_reads': r2_reads,
-            'r1_output': r1_output,
-            'r2_output': r2_output,
-            'clean_name': clean_target,
-            'processing_time': duration,
-            'speed_mb_per_sec': speed_mb_per_sec,
-            'skipped': False,
-            'paired_end_mismatches': len(mismatches) if mismatches else 0
-        }
-        
-        logging.info(f"  ✅ {clean_target}: {r1_reads:,} read pairs")
-        logging.info(f"  ⚡ Speed: {speed_mb_per_sec:.1f} MB/sec ({duration:.1f} seconds)")
-        
-        return result
-
-    # Parallel processing with progress bar
-    with ThreadPoolExecutor(max_workers=threads) as executor:
-        futures = []
-        for target, matched_sources in final_mapping.items():
-            futures.append(executor.submit(process_target, target, matched_sources, deduplicate))
-        for f in tqdm(as_completed(futures), total=len(futures), desc="Combining samples"):
-            res = f.result()
-            combination_stats[res['target']] = res
-    
-    # Output summary CSV
+    # The per-read parse loop holds the GIL even when isal inflates/deflates off it,
+    # so more than one worker only scales across processes
+    if executor_type == 'auto':
+        executor_type = 'process' if threads > 1 else 'thread'
+    logging.info(f"Executor: {executor_type} pool with {threads} workers")
+    if executor_type == 'process':
+        # A per-process threading semaphore would cap each worker separately, not the run
+        shared_semaphore = multiprocessing.BoundedSemaphore(MAX_IO_CONCURRENCY)
+        pool = ProcessPoolExecutor(max_workers=threads, initializer=set_io_concurrency,
+                                   initargs=(threads, io_concurrency, shared_semaphore))
+    else:
+        pool = ThreadPoolExecutor(max_workers=threads)
+    
+    # Summary CSV rows are written as each target finishes, not after the whole run
     csv_path = os.path.join(output_dir, "combination_summary.csv")
     with open(csv_path, 'w', newline='') as csvfile:
         writer = csv.writer(csvfile)
@@ -1314,25 +1654,42 @@ def combine_fastq_files_main(csv_file, output_dir="combined", search_dirs=None,
             "Processing Time (s)", "Speed (MB/s)", "Skipped", "Error", 
             "Paired-End Mismatches", "R1 Checksum", "R2 Checksum"
         ])
-        for target, stats in combination_stats.items():
-            # Calculate checksums for output files
-            r1_checksum = calculate_file_checksum(stats.get('r1_output', '')) if os.path.exists(stats.get('r1_output', '')) else None
-            r2_checksum = calculate_file_checksum(stats.get('r2_output', '')) if os.path.exists(stats.get('r2_output', '')) else None
-            
-            writer.writerow([
-                target,
-                stats.get('r1_output', ''),
-                stats.get('r2_output', ''),
-                stats.get('total_reads', 0),
-                stats.get('r2_reads', 0),
-                f"{stats.get('processing_time', 0):.2f}",
-                f"{stats.get('speed_mb_per_sec', 0):.2f}",
-                stats.get('skipped', False),
-                stats.get('error', ''),
-                stats.get('paired_end_mismatches', 0),
-                r1_checksum or '',
-                r2_checksum or ''
-            ])
+        
+        # Parallel processing with progress bar
+        with pool as executor:
+            futures = []
+            for target, matched_sources in final_mapping.items():
+                # Only ship this target's pairs to the worker
+                target_pairs = {s: file_pairs[s] for s in matched_sources}
+                total_size = sum(stat_cache[pair[read_type]].st_size
+                                 for pair in target_pairs.values() for read_type in ['R1', 'R2'])
+                futures.append(executor.submit(
+                    process_target, target, matched_sources, deduplicate, target_pairs, output_dir, force,
+                    buffer_size, validate, check_barcodes, gc_analysis, adapter_check, create_backups, deduplicate,
+                    total_size))
+            for f in tqdm(as_completed(futures), total=len(futures), desc="Combining samples"):
+                stats = f.result()
+                combination_stats[stats['target']] = stats
+                
+                # Checksums come from the combine pass; only hash outputs it did not write
+                r1_checksum = stats.get('r1_checksum') or (calculate_file_checksum(stats.get('r1_output', '')) if os.path.exists(stats.get('r1_output', '')) else None)
+                r2_checksum = stats.get('r2_checksum') or (calculate_file_checksum(stats.get('r2_output', '')) if os.path.exists(stats.get('r2_output', '')) else None)
+                
+                writer.writerow([
+                    stats['target'],
+                    stats.get('r1_output', ''),
+                    stats.get('r2_output', ''),
+                    stats.get('total_reads', 0),
+                    stats.get('r2_reads', 0),
+                    f"{stats.get('processing_time', 0):.2f}",
+                    f"{stats.get('speed_mb_per_sec', 0):.2f}",
+                    stats.get('skipped', False),
+                    stats.get('error', ''),
+                    stats.get('paired_end_mismatches', 0),
+                    r1_checksum or '',
+                    r2_checksum or ''
+                ])
+                csvfile.flush()
     logging.info(f"📄 CSV summary: {csv_path}")
     
     # Generate reports
@@ -1359,8 +1716,8 @@ def combine_fastq_files_main(csv_file, output_dir="combined", search_dirs=None,
     if fuzzy_matches:
         logging.info(f"🎯 Applied {len(fuzzy_matches)} fuzzy matches for typos/variations")
 
-def main():
-    """Main CLI entry point with enhanced features"""
+def main(argv=None):
+    """Main CLI entry point with enhanced features; argv defaults to sys.argv[1:]"""
     parser = argparse.ArgumentParser(
         description="⚡ FASTQ File Combiner - High-speed streaming I/O with minimal RAM usage",
         formatter_class=argparse.RawDescriptionHelpFormatter,
@@ -1378,11 +1735,16 @@ Examples:
     parser.add_argument('--search-dirs', nargs='+', help='Directories to search for FASTQ files')
     parser.add_argument('--dry-run', action='store_true', help='Show what would be done without processing')
     parser.add_argument('--force', '-f', action='store_true', help='Overwrite existing output files')
-    parser.add_argument('--threads', '-t', type=int, default=4, help='Number of threads (default: 4)')
-    parser.add_argument('--buffer-size', type=int, default=BUFFER_SIZE, help=f'Buffer size in bytes (default: {BUFFER_SIZE})')
+    parser.add_argument('--threads', '-t', type=int, help='Number of threads (default: min(CPUs, targets))')
+    parser.add_argument('--buffer-size', type=int, help='Read/write buffer per open FASTQ in bytes (default: 1 MiB)')
+    parser.add_argument('--io-concurrency', type=int, help='Max concurrent disk readers (default: min(threads, 8))')
+    parser.add_argument('--executor', choices=['auto', 'thread', 'process'], default='auto',
+                        help='Worker pool type (default: auto = processes for more than one worker)')
     
     # Analysis options
-    parser.add_argument('--validate', action='store_true', help='Validate FASTQ quality and format')
+    parser.add_argument('--validate', action='store_true',
+                        help=f'Validate FASTQ quality and format on the first {VALIDATE_HEAD_READS} reads of each source')
+    parser.add_argument('--validate-full', action='store_true', help='Validate every read (implies --validate)')
     parser.add_argument('--check-barcodes', action='store_true', help='Extract and analyze sample barcodes')
     parser.add_argument('--gc-analysis', action='store_true', help='Calculate GC content statistics')
     parser.add_argument('--adapter-check', action='store_true', help='Detect common adapter sequences')
@@ -1408,7 +1770,7 @@ Examples:
     parser.add_argument('--diagnostics', action='store_true', help='Print system diagnostics')
     parser.add_argument('--profile', action='store_true', help='Enable performance profiling')
     
-    args = parser.parse_args()
+    args = parser.parse_args(argv)
     
     # Print diagnostics if requested
     if args.diagnostics:
@@ -1428,9 +1790,12 @@ Examples:
             # Apply config overrides
             args.output = get_opt('output', 'combined')
             args.search_dirs = get_opt('search_dirs', None)
-            args.threads = get_opt('threads', 4)
-            args.buffer_size = get_opt('buffer_size', BUFFER_SIZE)
+            args.threads = get_opt('threads', None)
+            args.buffer_size = get_opt('buffer_size', None)
+            args.io_concurrency = get_opt('io_concurrency', None)
+            args.executor = get_opt('executor', 'auto')
             args.validate = get_opt('validate', False)
+            args.validate_full = get_opt('validate_full', False)
             args.check_barcodes = get_opt('check_barcodes', False)
             args.gc_analysis = get_opt('gc_analysis', False)
             args.adapter_check = get_opt('adapter_check', False)
@@ -1471,7 +1836,7 @@ Examples:
             r2_patterns=args.r2_patterns,
             threads=args.threads,
             buffer_size=args.buffer_size,
-            validate=args.validate,
+            validate='full' if args.validate_full else args.validate,
             check_barcodes=args.check_barcodes,
             gc_analysis=args.gc_analysis,
             adapter_check=args.adapter_check,
@@ -1481,7 +1846,9 @@ Examples:
             checkpoint=args.checkpoint,
             no_html=args.no_html,
             no_csv=args.no_csv,
-            deduplicate=args.deduplicate
+            deduplicate=args.deduplicate,
+            io_concurrency=args.io_concurrency,
+            executor_type=args.executor
         )
         
     except KeyboardInterrupt:
@@ -1593,7 +1960,7 @@ def print_diagnostics():
     print(f"Storage type: {storage_type}")
     
     # Check dependencies
-    dependencies = ['gzip', 'yaml', 'tqdm', 'psutil']
+    dependencies = ['gzip', 'isal', 'orjson', 'yaml', 'tqdm', 'psutil']
     print("\nDependencies:")
     for dep in dependencies:
         try:
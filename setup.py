@@ -11,6 +11,9 @@ setup(
         'tqdm',
         'pyyaml',
     ],
+    extras_require={
+        'test': ['pytest', 'pytest-xdist'],
+    },
     entry_points={
         'console_scripts': [
             'fastq-combiner=fastq_combiner:main',
@@ -1,8 +1,9 @@
 import argparse
 import os
 import csv
-from pathlib import Path
-from .utils import count_reads_fastq, combine_fastq_files, md5sum
+import re
+from concurrent.futures import ThreadPoolExecutor
+from .utils import count_reads_fastq, combine_fastq_files, file_hash, new_hasher, HASH_ALGORITHMS, OUTPUT_FORMATS
 from .report import generate_html_report
 
 
@@ -17,43 +18,58 @@ def read_mapping_file(csv_file):
             mapping[target.strip()] = [s.strip() for s in sources if s.strip()]
     return mapping
 
+# Single-pass equivalent of the R1 globs *_R1_*.fastq*, *_R1.fastq*, *_1.fastq*, *.R1.fastq* (and .fq)
+R1_NAME_RE = re.compile(r'_R1_.*\.(fastq|fq)|(_R1|_1|\.R1)\.(fastq|fq)')
+
+def walk_files(root):
+    """Yield os.DirEntry for every file under root, without following directory symlinks"""
+    stack = [root]
+    while stack:
+        with os.scandir(stack.pop()) as it:
+            for entry in it:
+                if entry.is_dir(follow_symlinks=False):
+                    stack.append(entry.path)
+                elif entry.is_file():
+                    yield entry
+
 def find_fastq_pairs(search_dirs):
-    patterns = [
-        "*_R1_*.fastq*", "*_R1.fastq*", "*_1.fastq*", "*.R1.fastq*",
-        "*_R1_*.fq*", "*_R1.fq*", "*_1.fq*", "*.R1.fq*"
-    ]
     file_pairs = {}
     search_dirs = search_dirs or ["."]
     for search_dir in search_dirs:
-        for pattern in patterns:
-            for r1_file in Path(search_dir).rglob(pattern):
-                basename = r1_file.name
-                if "_S" in basename and "_R1_" in basename:
-                    sample_base = basename.split("_S")[0]
-                elif "_R1_" in basename:
-                    sample_base = basename.split("_R1_")[0]
-                elif "_R1." in basename:
-                    sample_base = basename.split("_R1.")[0]
-                elif "_1." in basename:
-                    sample_base = basename.split("_1.")[0]
-                elif ".R1." in basename:
-                    sample_base = basename.split(".R1.")[0]
-                else:
-                    continue
-                r2_candidates = [
-                    str(r1_file).replace("_R1_", "_R2_"),
-                    str(r1_file).replace("_R1.", "_R2."),
-                    str(r1_file).replace("_1.", "_2."),
-                    str(r1_file).replace(".R1.", ".R2.")
-                ]
-                r2_file = next((c for c in r2_candidates if os.path.exists(c)), None)
-                if not r2_file:
-                    continue
-                key = sample_base
-                file_pairs[key] = {
-                    'R1': str(r1_file.resolve()),
-                    'R2': os.path.abspath(r2_file)
-                }
+        entries = list(walk_files(search_dir))
+        # R2 lookups hit this set instead of stat()ing up to four candidate paths per R1
+        all_files = {entry.path for entry in entries}
+        for entry in entries:
+            basename = entry.name
+            if not R1_NAME_RE.search(basename):
+                continue
+            r1_file = entry.path
+            if "_S" in basename and "_R1_" in basename:
+                sample_base = basename.split("_S")[0]
+            elif "_R1_" in basename:
+                sample_base = basename.split("_R1_")[0]
+            elif "_R1." in basename:
+                sample_base = basename.split("_R1.")[0]
+            elif "_1." in basename:
+                sample_base = basename.split("_1.")[0]
+            elif ".R1." in basename:
+                sample_base = basename.split(".R1.")[0]
+            else:
+                continue
+            r2_candidates = [
+                r1_file.replace("_R1_", "_R2_"),
+                r1_file.replace("_R1.", "_R2."),
+                r1_file.replace("_1.", "_2."),
+                r1_file.replace(".R1.", ".R2.")
+            ]
+            r2_file = next((c for c in r2_candidates if c in all_files), None)
+            if not r2_file:
+                continue
+            key = sample_base
+            file_pairs[key] = {
+                'R1': os.path.realpath(r1_file),
+                'R2': os.path.abspath(r2_file)
+            }
     return file_pairs
 
 def run_combiner():
@@ -62,7 +78,23 @@ def run_combiner():
     parser.add_argument('-o', '--output-dir', default='combined', help='Output directory')
     parser.add_argument('-d', '--search-dirs', nargs='+', help='Dirs to search for FASTQ')
     parser.add_argument('--validate-only', action='store_true', help='Validate R1/R2 read counts without combining')
+    parser.add_argument('--compresslevel', type=int, default=1, help='Gzip level for recompressed output (default: 1)')
+    parser.add_argument('--compression-threads', type=int, default=max(1, (os.cpu_count() or 1) // 2),
+                        help='Threads deflating each recompressed output (default: half the CPUs; needs isal)')
+    parser.add_argument('--format', dest='output_format', choices=OUTPUT_FORMATS, default='gzip',
+                        help='Output container: gzip, or bgzf blocks that downstream tools can decompress in parallel '
+                             '(bgzf always recompresses; default: gzip)')
+    parser.add_argument('--hash', choices=HASH_ALGORITHMS, default='md5',
+                        help='Checksum for combined outputs (default: md5; blake3/xxh3 are faster but need their packages)')
+    parser.add_argument('--uniform-records', action='store_true',
+                        help='Inputs have fixed-length records: count reads from decompressed size instead of decoding '
+                             '(plain FASTQ and BGZF only; other gzip, or a size that is not a whole number of records, '
+                             'is counted in full)')
     args = parser.parse_args()
+    try:
+        new_hasher(args.hash)
+    except ValueError as e:
+        parser.error(str(e))
 
     print(f"Running FASTQ Combiner Improved")
     print(f"CSV: {args.csv_file}")
@@ -93,25 +125,29 @@ def run_combiner():
             continue
 
         print(f"[{target}] Validating {len(matched)} source(s)")
-        total_r1 = 0
-        total_r2 = 0
-
-        for src in matched:
-            r1_file = file_pairs[src]['R1']
-            r2_file = file_pairs[src]['R2']
-            r1_count = count_reads_fastq(r1_file)
-            r2_count = count_reads_fastq(r2_file)
-            total_r1 += r1_count
-            total_r2 += r2_count
+        # Per-source counts are reused by the combine step instead of decoding every source twice
+        r1_counts = []
+        r2_counts = []
+
+        pairs = [file_pairs[s] for s in matched]
+        for src, pair in zip(matched, pairs):
+            r1_file = pair['R1']
+            r2_file = pair['R2']
+            r1_count = count_reads_fastq(r1_file, args.uniform_records)
+            r2_count = count_reads_fastq(r2_file, args.uniform_records)
+            r1_counts.append(r1_count)
+            r2_counts.append(r2_count)
             print(f"  {src}: R1={r1_count} R2={r2_count}")
+        total_r1 = sum(r1_counts)
+        total_r2 = sum(r2_counts)
 
         status = "PASS" if total_r1 == total_r2 else "FAIL"
 
         # If combining is enabled, produce combined FASTQs
         combined_r1_output = ""
         combined_r2_output = ""
-        md5_r1 = ""
-        md5_r2 = ""
+        hash_r1 = ""
+        hash_r2 = ""
 
         if not args.validate_only:
             clean_target = target.replace(" ", "_").replace("-", "_")
@@ -119,12 +155,17 @@ def run_combiner():
             combined_r2_output = os.path.join(args.output_dir, f"{clean_target}_S1_R2_001.fastq.gz")
             print(f"[{target}] Combining R1 → {combined_r1_output}")
             print(f"[{target}] Combining R2 → {combined_r2_output}")
-            r1_combined_reads = combine_fastq_files([file_pairs[s]['R1'] for s in matched], combined_r1_output)
-            r2_combined_reads = combine_fastq_files([file_pairs[s]['R2'] for s in matched], combined_r2_output)
-            md5_r1 = md5sum(combined_r1_output)
-            md5_r2 = md5sum(combined_r2_output)
-            print(f"[{target}] Combined R1 reads: {r1_combined_reads}, md5: {md5_r1}")
-            print(f"[{target}] Combined R2 reads: {r2_combined_reads}, md5: {md5_r2}")
+            r1_combined_reads = combine_fastq_files([pair['R1'] for pair in pairs], combined_r1_output,
+                                                    compresslevel=args.compresslevel, compression_threads=args.compression_threads,
+                                                    source_reads=r1_counts, output_format=args.output_format)
+            r2_combined_reads = combine_fastq_files([pair['R2'] for pair in pairs], combined_r2_output,
+                                                    compresslevel=args.compresslevel, compression_threads=args.compression_threads,
+                                                    source_reads=r2_counts, output_format=args.output_format)
+            # hashlib releases the GIL on large buffers, so R1 and R2 hash concurrently
+            with ThreadPoolExecutor(max_workers=2) as pool:
+                hash_r1, hash_r2 = pool.map(lambda path: file_hash(path, args.hash), [combined_r1_output, combined_r2_output])
+            print(f"[{target}] Combined R1 reads: {r1_combined_reads}, {args.hash}: {hash_r1}")
+            print(f"[{target}] Combined R2 reads: {r2_combined_reads}, {args.hash}: {hash_r2}")
 
         results.append({
             "sample": target,
@@ -133,11 +174,15 @@ def run_combiner():
             "status": status,
             "combined_r1_output": combined_r1_output,
             "combined_r2_output": combined_r2_output,
-            "md5_r1": md5_r1,
-            "md5_r2": md5_r2
+            "hash_r1": hash_r1,
+            "hash_r2": hash_r2
         })
+        if args.hash == 'md5':
+            # Older consumers of the results read the md5_* keys
+            results[-1]["md5_r1"] = hash_r1
+            results[-1]["md5_r2"] = hash_r2
 
     # Write HTML report
-    generate_html_report(args.output_dir, results)
+    generate_html_report(args.output_dir, results, args.hash)
 
     print(f"Done. {len(results)} targets processed.")
@@ -1,6 +1,20 @@
+import html
 import os
 
-def generate_html_report(output_dir, results):
+ROW_TEMPLATE = (
+    "<tr>"
+    "<td>{sample}</td>"
+    "<td>{r1_count}</td>"
+    "<td>{r2_count}</td>"
+    "<td>{status}</td>"
+    "<td>{r1_name}</td>"
+    "<td>{r2_name}</td>"
+    "<td>{hash_r1}</td>"
+    "<td>{hash_r2}</td>"
+    "</tr>"
+)
+
+def generate_html_report(output_dir, results, hash_algo="md5"):
     html_path = os.path.join(output_dir, "combination_report.html")
     with open(html_path, 'w') as f:
         f.write("<html><head><title>FASTQ Combiner Report</title>")
@@ -14,21 +28,21 @@ def generate_html_report(output_dir, results):
         f.write("<th>Status</th>")
         f.write("<th>Combined R1 Output</th>")
         f.write("<th>Combined R2 Output</th>")
-        f.write("<th>MD5 R1</th>")
-        f.write("<th>MD5 R2</th>")
+        f.write(f"<th>{hash_algo.upper()} R1</th>")
+        f.write(f"<th>{hash_algo.upper()} R2</th>")
         f.write("</tr></thead><tbody>")
 
-        for res in results:
-            f.write("<tr>")
-            f.write(f"<td>{res['sample']}</td>")
-            f.write(f"<td>{res['r1_count']}</td>")
-            f.write(f"<td>{res['r2_count']}</td>")
-            f.write(f"<td>{res['status']}</td>")
-            f.write(f"<td>{os.path.basename(res['combined_r1_output']) if res['combined_r1_output'] else ''}</td>")
-            f.write(f"<td>{os.path.basename(res['combined_r2_output']) if res['combined_r2_output'] else ''}</td>")
-            f.write(f"<td>{res['md5_r1']}</td>")
-            f.write(f"<td>{res['md5_r2']}</td>")
-            f.write("</tr>")
+        # One template per row, joined and written in a single call; names come from user files, so escape them
+        f.write("".join(ROW_TEMPLATE.format_map({
+            "sample": html.escape(res['sample']),
+            "r1_count": res['r1_count'],
+            "r2_count": res['r2_count'],
+            "status": res['status'],
+            "r1_name": html.escape(os.path.basename(res['combined_r1_output'])),
+            "r2_name": html.escape(os.path.basename(res['combined_r2_output'])),
+            "hash_r1": res.get('hash_r1', res.get('md5_r1', '')),
+            "hash_r2": res.get('hash_r2', res.get('md5_r2', '')),
+        }) for res in results))
 
         f.write("</tbody></table></body></html>")
 
@@ -1,74 +1,439 @@
-import gzip
 import hashlib
-import shutil
+import mmap
 import os
+import queue
+import struct
+import threading
+from concurrent.futures import ThreadPoolExecutor
 
-def count_reads_fastq(fastq_file: str) -> int:
-    count = 0
+try:
+    # ISA-L accelerated DEFLATE; same open() API as the stdlib module
+    from isal import igzip as gzip
+    from isal import igzip_threaded
+    from isal import isal_zlib as deflate_zlib
+    GZIP_MAX_LEVEL = 3
+except ImportError:
+    import gzip
+    import zlib as deflate_zlib
+    igzip_threaded = None
+    GZIP_MAX_LEVEL = 9
+
+try:
+    # Parallel single-stream gzip decoding for large inputs
+    import rapidgzip
+except ImportError:
+    rapidgzip = None
+
+try:
+    # SIMD, multithreaded tree hash; much faster than MD5 for integrity checks
+    import blake3
+except ImportError:
+    blake3 = None
+
+try:
+    import xxhash
+except ImportError:
+    xxhash = None
+
+HASH_ALGORITHMS = ('md5', 'blake3', 'xxh3')
+
+# Below this size the parallel decoder's startup cost outweighs its speedup
+RAPIDGZIP_MIN_SIZE = 256 * 1024 * 1024
+# BGZF block boundaries are recorded in the headers, so no boundary search is needed and it pays off much sooner
+RAPIDGZIP_BGZF_MIN_SIZE = 16 * 1024 * 1024
+
+# BGZF: gzip members of at most 64 KiB, each flagged with its size so readers can split the file
+OUTPUT_FORMATS = ('gzip', 'bgzf')
+BGZF_BLOCK_SIZE = 65280  # uncompressed bytes per block, as htslib uses
+BGZF_EOF = bytes.fromhex("1f8b08040000000000ff0600424302001b0003000000000000000000")
+
+# Decoded chunks buffered between the reader and writer threads in combine_fastq_files
+PIPELINE_DEPTH = 8
+
+def count_lines(f, chunk_size: int = 16 * 1024 * 1024) -> int:
+    """
+    Count lines in a binary stream with bytes.count (a C memchr loop), including an unterminated last line.
+    That already outpaces inflate, so a numpy (arr == 10).sum() would only add a mask allocation per chunk.
+    """
+    lines = 0
+    last_byte = b"\n"
+    # One buffer filled in place with readinto, instead of a fresh bytes object per chunk
+    buf = bytearray(chunk_size)
+    while True:
+        n = f.readinto(buf)
+        if not n:
+            break
+        lines += buf.count(b"\n", 0, n)
+        last_byte = buf[n - 1:n]
+    if last_byte != b"\n":
+        lines += 1
+    return lines
+
+def copy_stream(in_f, out_f, buffer_size: int = 8 * 1024 * 1024) -> None:
+    """shutil.copyfileobj, but reading into one reused buffer instead of allocating every chunk"""
+    buf = bytearray(buffer_size)
+    view = memoryview(buf)
+    while True:
+        n = in_f.readinto(buf)
+        if not n:
+            break
+        out_f.write(view[:n])
+
+def count_lines_mmap(filename: str, chunk_size: int = 16 * 1024 * 1024) -> int:
+    """Count lines in an uncompressed file through a read-only memory map, with sequential readahead"""
+    with open(filename, 'rb') as f:
+        size = os.fstat(f.fileno()).st_size
+        if size == 0:
+            return 0
+        with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+            if hasattr(mmap, 'MADV_SEQUENTIAL'):
+                mm.madvise(mmap.MADV_SEQUENTIAL)
+            lines = 0
+            for offset in range(0, size, chunk_size):
+                lines += mm[offset:offset + chunk_size].count(b"\n")
+            if mm[size - 1] != ord("\n"):
+                lines += 1
+    return lines
+
+def count_uniform_reads(fastq_file: str):
+    """
+    Count reads from the decompressed size alone, assuming every record is as long as the first one
+    (fixed-length reads with identically formatted headers, as simulators and some instruments write).
+    The size comes from the file size or the summed BGZF block trailers. Other gzip files return None, as
+    their ISIZE trailer only covers the last member (concat output has one per source); so does a size
+    that is not a whole number of records. Callers then fall back to a full count.
+    """
+    if not fastq_file.endswith('.gz'):
+        size = os.path.getsize(fastq_file)
+    elif is_bgzf(fastq_file):
+        size = bgzf_decompressed_size(fastq_file)
+    else:
+        return None
+    if not size:
+        return None
     opener = gzip.open if fastq_file.endswith('.gz') else open
-    with opener(fastq_file, 'rt') as f:
+    with opener(fastq_file, 'rb') as f:
+        record = [f.readline() for _ in range(4)]
+    if not record[3].endswith(b"\n"):
+        return None
+    record_len = sum(len(line) for line in record)
+    if size % record_len:
+        return None
+    return size // record_len
+
+def count_reads_fastq(fastq_file: str, uniform_records: bool = False) -> int:
+    if uniform_records:
+        reads = count_uniform_reads(fastq_file)
+        if reads is not None:
+            return reads
+    # Every FASTQ record is exactly four lines, so a trailing partial record is dropped by the division
+    if not fastq_file.endswith('.gz'):
+        return count_lines_mmap(fastq_file) // 4
+    with open_fastq_source(fastq_file) as f:
+        return count_lines(f) // 4
+
+def new_hasher(algo: str = "md5"):
+    """Create a hash object for one of HASH_ALGORITHMS"""
+    if algo == "md5":
+        return hashlib.md5()
+    if algo == "blake3":
+        if blake3 is None:
+            raise ValueError("blake3 hashing requires the blake3 package (pip install blake3)")
+        return blake3.blake3(max_threads=blake3.blake3.AUTO)
+    if algo == "xxh3":
+        if xxhash is None:
+            raise ValueError("xxh3 hashing requires the xxhash package (pip install xxhash)")
+        return xxhash.xxh3_128()
+    raise ValueError(f"Unknown hash algorithm: {algo}")
+
+def file_hash(filename: str, algo: str = "md5", blocksize: int = 2**20) -> str:
+    """Hex digest of a file's contents"""
+    # Unbuffered: the hashing loop reads straight into its own buffer, with no second copy through BufferedReader
+    with open(filename, "rb", buffering=0) as f:
+        if hasattr(hashlib, "file_digest"):
+            # Python 3.11+: hashing loop runs in C with its own buffer
+            return hashlib.file_digest(f, lambda: new_hasher(algo)).hexdigest()
+        m = new_hasher(algo)
+        buf = bytearray(blocksize)
+        view = memoryview(buf)
         while True:
-            # Read all four lines of a FASTQ record
-            header = f.readline()
-            if not header:
+            n = f.readinto(buf)
+            if not n:
                 break
-            seq = f.readline()
-            plus = f.readline()
-            qual = f.readline()
-            # Only count if all four lines are present and valid
-            if (header.startswith('@') and seq and plus and qual):
-                count += 1
-    return count
+            m.update(view[:n])
+    return m.hexdigest()
 
 def md5sum(filename: str, blocksize: int = 2**20) -> str:
-    m = hashlib.md5()
-    with open(filename, "rb") as f:
-        for block in iter(lambda: f.read(blocksize), b""):
-            m.update(block)
-    return m.hexdigest()
+    return file_hash(filename, "md5", blocksize)
 
 def get_decompressed_size(filename: str) -> int:
-    """Get actual decompressed size of a gzipped file"""
+    """
+    Get the exact decompressed size of a FASTQ file.
+    BGZF sizes come from the per-block ISIZE fields without inflating anything. Other gzip files are
+    decoded: their ISIZE trailer covers only the last member (concat_files output has one per source)
+    and wraps at 4 GiB, so it cannot be trusted.
+    """
     if not filename.endswith('.gz'):
         return os.path.getsize(filename)
-    
-    with gzip.open(filename, 'rb') as f:
-        # Read in chunks to avoid memory issues
-        size = 0
+    if is_bgzf(filename):
+        size = bgzf_decompressed_size(filename)
+        if size is not None:
+            return size
+    size = 0
+    buf = bytearray(1024 * 1024)
+    with open_fastq_source(filename) as f:
         while True:
-            chunk = f.read(1024 * 1024)  # 1MB chunks
-            if not chunk:
+            n = f.readinto(buf)
+            if not n:
                 break
-            size += len(chunk)
+            size += n
     return size
 
-def combine_fastq_files(source_files: list, output_file: str, buffer_size: int = 8 * 1024 * 1024, compresslevel: int = 6) -> int:
+def is_bgzf(filename: str) -> bool:
+    """True if the file starts with a BGZF block (gzip member whose FEXTRA field carries a 'BC' subfield)"""
+    with open(filename, 'rb') as f:
+        header = f.read(18)
+    return len(header) == 18 and header[:4] == b"\x1f\x8b\x08\x04" and header[12:14] == b"BC"
+
+def bgzf_decompressed_size(filename: str):
+    """Sum the ISIZE trailers of every BGZF block (two small reads per block, nothing inflated); None if not BGZF"""
+    size = 0
+    with open(filename, 'rb') as f:
+        while True:
+            header = f.read(18)
+            if not header:
+                return size
+            if len(header) < 18 or header[12:14] != b"BC":
+                return None
+            block_size = int.from_bytes(header[16:18], 'little') + 1
+            f.seek(block_size - 22, os.SEEK_CUR)
+            size += int.from_bytes(f.read(4), 'little')
+
+def open_fastq_source(src: str, threads: int = 0):
+    """Open a FASTQ source for binary reading, decoding large gzip files in parallel when rapidgzip is installed"""
+    if not src.endswith('.gz'):
+        return open(src, 'rb')
+    if rapidgzip is not None:
+        size = os.path.getsize(src)
+        if size >= RAPIDGZIP_MIN_SIZE or (size >= RAPIDGZIP_BGZF_MIN_SIZE and is_bgzf(src)):
+            return rapidgzip.open(src, parallelization=threads or os.cpu_count())
+    return gzip.open(src, 'rb')
+
+def _kernel_copiers() -> list:
+    """In-kernel copy calls available on this platform, fastest first, as fn(in_fd, out_fd, offset, count)"""
+    copiers = []
+    if hasattr(os, 'copy_file_range'):
+        # Can reflink or copy inside the filesystem without touching the page cache
+        copiers.append(lambda in_fd, out_fd, offset, count: os.copy_file_range(in_fd, out_fd, count, offset))
+    if hasattr(os, 'sendfile'):
+        copiers.append(lambda in_fd, out_fd, offset, count: os.sendfile(out_fd, in_fd, offset, count))
+    return copiers
+
+def append_file(out_f, src: str, buffer_size: int = 8 * 1024 * 1024) -> None:
+    """Append src to the open binary file out_f, in-kernel via copy_file_range or sendfile where supported"""
+    with open(src, 'rb') as in_f:
+        out_f.flush()
+        in_fd, out_fd = in_f.fileno(), out_f.fileno()
+        size = os.fstat(in_fd).st_size
+        offset = 0
+        for copy in _kernel_copiers():
+            try:
+                while offset < size:
+                    sent = copy(in_fd, out_fd, offset, size - offset)
+                    if sent == 0:
+                        # Stopped short (e.g. the filesystem declined); let the next method finish the file
+                        break
+                    offset += sent
+            except OSError:
+                # e.g. EXDEV across filesystems, or macOS sendfile to a non-socket;
+                # the output position has advanced with offset, so the next method resumes there
+                pass
+            if offset >= size:
+                return
+        in_f.seek(offset)
+        copy_stream(in_f, out_f, buffer_size)
+
+def concat_files(source_files: list, output_file: str, buffer_size: int = 8 * 1024 * 1024,
+                 source_reads: list = None) -> int:
+    """
+    Concatenate sources byte-for-byte without decoding them.
+    Works for plain FASTQ and for gzip: back-to-back gzip members form a valid gzip stream,
+    which zcat and Cell Ranger read as one file.
+    source_reads (read count per source, e.g. from validation) avoids decoding each source again to count it.
+    """
     total_reads = 0
-    
-    opener = gzip.open if output_file.endswith('.gz') else open
-    with opener(output_file, 'wb', compresslevel=compresslevel) if output_file.endswith('.gz') \
-         else open(output_file, 'wb') as out_f:
-        
+    with open(output_file, 'wb') as out_f:
         for i, src in enumerate(source_files, 1):
+            base = os.path.basename(src)
             file_size = os.path.getsize(src)
             file_type = "compressed" if src.endswith('.gz') else "uncompressed"
-            print(f"    [{i}/{len(source_files)}] Processing {os.path.basename(src)} ({file_size / (1024**3):.2f} GB {file_type})")
+            print(f"    [{i}/{len(source_files)}] Appending {base} ({file_size / (1024**3):.2f} GB {file_type}, no recompression)")
+            append_file(out_f, src, buffer_size)
+            print(f"      ✓ Complete: {base}")
+            total_reads += source_reads[i - 1] if source_reads is not None else count_reads_fastq(src)
+    return total_reads
+
+def open_gzip_writer(raw, compresslevel: int, compression_threads: int = 1, output_format: str = 'gzip'):
+    """Wrap a binary file in a gzip (or BGZF) writer, deflating blocks on several threads when isal is installed"""
+    if output_format == 'bgzf':
+        return BgzfWriter(raw, compresslevel, compression_threads)
+    if igzip_threaded is not None and compression_threads > 1:
+        return igzip_threaded.open(raw, 'wb', compresslevel=compresslevel, threads=compression_threads)
+    return gzip.GzipFile(fileobj=raw, mode='wb', compresslevel=compresslevel)
+
+def bgzf_block(data: bytes, compresslevel: int) -> bytes:
+    """Compress up to BGZF_BLOCK_SIZE bytes into one self-contained BGZF block"""
+    c = deflate_zlib.compressobj(compresslevel, deflate_zlib.DEFLATED, -15)
+    cdata = c.compress(data) + c.flush()
+    # Fixed gzip header with FEXTRA set, carrying the 'BC' subfield holding total block size - 1
+    header = struct.pack('<4BIBBHBBHH', 0x1f, 0x8b, 8, 4, 0, 0, 0xff, 6, ord('B'), ord('C'), 2, len(cdata) + 25)
+    return header + cdata + struct.pack('<II', deflate_zlib.crc32(data) & 0xffffffff, len(data))
+
+class BgzfWriter:
+    """
+    Write-only BGZF stream: valid gzip for any reader, but split into independent blocks
+    that htslib, rapidgzip and friends can decompress in parallel.
+    Blocks are independent, so with compression_threads > 1 they are deflated on a thread pool.
+    """
+
+    def __init__(self, raw, compresslevel: int = 1, compression_threads: int = 1):
+        self.raw = raw
+        self.compresslevel = compresslevel
+        self.pending = bytearray()
+        self.pool = ThreadPoolExecutor(compression_threads) if compression_threads > 1 else None
+        # Enough blocks per batch to keep every thread busy
+        self.batch_size = BGZF_BLOCK_SIZE * max(1, compression_threads) * 4
+
+    def write(self, data) -> int:
+        self.pending += data
+        if len(self.pending) >= self.batch_size:
+            self._write_blocks(len(self.pending) - len(self.pending) % BGZF_BLOCK_SIZE)
+        return len(data)
+
+    def _write_blocks(self, end: int) -> None:
+        pieces = [bytes(self.pending[i:min(i + BGZF_BLOCK_SIZE, end)]) for i in range(0, end, BGZF_BLOCK_SIZE)]
+        del self.pending[:end]
+        if self.pool is not None:
+            blocks = self.pool.map(bgzf_block, pieces, [self.compresslevel] * len(pieces))
+        else:
+            blocks = (bgzf_block(piece, self.compresslevel) for piece in pieces)
+        for block in blocks:
+            self.raw.write(block)
+
+    def flush(self) -> None:
+        self.raw.flush()
+
+    def close(self) -> None:
+        if self.pending:
+            self._write_blocks(len(self.pending))
+        self.raw.write(BGZF_EOF)
+        self.raw.flush()
+        if self.pool is not None:
+            self.pool.shutdown()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+def _decode_sources(source_files: list, buffer_size: int, threads: int, chunks: queue.Queue, stop: threading.Event,
+                    free: queue.Queue) -> None:
+    """
+    Producer for combine_fastq_files: queue (src, buffer, length) items for each source in order,
+    then (src, None, 0) to close it. A read error is queued as (None, exception, 0).
+    Buffers are taken from free (the consumer returns them after writing) so steady state allocates nothing.
+    """
+    def put(item):
+        # Give up once the consumer has stopped so a failed write never leaves us blocked
+        while not stop.is_set():
+            try:
+                chunks.put(item, timeout=0.1)
+                return True
+            except queue.Full:
+                continue
+        return False
+
+    try:
+        for src in source_files:
+            with open_fastq_source(src, threads) as in_f:
+                while True:
+                    try:
+                        buf = free.get_nowait()
+                    except queue.Empty:
+                        buf = bytearray(buffer_size)
+                    n = in_f.readinto(buf)
+                    if not n:
+                        break
+                    if not put((src, buf, n)):
+                        return
+            if not put((src, None, 0)):
+                return
+    except Exception as e:
+        put((None, e, 0))
+
+def combine_fastq_files(source_files: list, output_file: str, buffer_size: int = 8 * 1024 * 1024, compresslevel: int = 1,
+                        threads: int = 0, concat: bool = True, compression_threads: int = 1,
+                        source_reads: list = None, output_format: str = 'gzip') -> int:
+    # Sources already in the output's format can be appended as raw bytes
+    # (BGZF output is always re-blocked, since sources may be single-member gzip)
+    output_gz = output_file.endswith('.gz')
+    if concat and output_format != 'bgzf' and all(src.endswith('.gz') == output_gz for src in source_files):
+        return concat_files(source_files, output_file, buffer_size, source_reads)
+
+    total_reads = 0
+    
+    # Decode on a producer thread so inflating the next chunk overlaps deflating the current one
+    chunks = queue.Queue(maxsize=PIPELINE_DEPTH)
+    free = queue.Queue()
+    stop = threading.Event()
+    producer = threading.Thread(target=_decode_sources, args=(source_files, buffer_size, threads, chunks, stop, free),
+                                daemon=True)
+    producer.start()
+    
+    # Level 1 costs a few percent in ratio but deflates several times faster than 6
+    compresslevel = min(compresslevel, GZIP_MAX_LEVEL)
+    try:
+        # Large buffer on the raw file so compressed output reaches disk in few, big writes
+        with open(output_file, 'wb', buffering=buffer_size) as raw, \
+             open_gzip_writer(raw, compresslevel, compression_threads, output_format) if output_gz else raw as out_f:
             
-            src_opener = gzip.open if src.endswith('.gz') else open
-            with src_opener(src, 'rb') as in_f:
+            for i, src in enumerate(source_files, 1):
+                base = os.path.basename(src)
+                is_gz = src.endswith('.gz')
+                file_size = os.path.getsize(src)
+                file_type = "compressed" if is_gz else "uncompressed"
+                print(f"    [{i}/{len(source_files)}] Processing {base} ({file_size / (1024**3):.2f} GB {file_type})")
+                
                 bytes_processed = 0
+                newlines = 0
+                last_byte = b"\n"
                 while True:
-                    chunk = in_f.read(buffer_size)
-                    if not chunk:
+                    item_src, buf, n = chunks.get()
+                    if item_src is None:
+                        raise buf
+                    if buf is None:
                         break
-                    out_f.write(chunk)
-                    bytes_processed += len(chunk)
+                    # Every writer copies or consumes the bytes before returning, so the buffer can be recycled
+                    with memoryview(buf) as view:
+                        out_f.write(view[:n])
+                    # Count reads in the same pass instead of decompressing the source again
+                    newlines += buf.count(b"\n", 0, n)
+                    bytes_processed += n
+                    last_byte = buf[n - 1:n]
+                    free.put(buf)
                     
                     # Show progress every 200MB - ONLY data processed, NO percentage
-                    if bytes_processed % (200 * 1024 * 1024) < len(chunk):
+                    if bytes_processed % (200 * 1024 * 1024) < n:
                         print(f"      Processed: {bytes_processed / (1024**3):.2f} GB")
-            
-            print(f"      ✓ Complete: {os.path.basename(src)} - Total processed: {bytes_processed / (1024**3):.2f} GB")
-            total_reads += count_reads_fastq(src)
+                # A final record without a trailing newline is still a full record
+                if last_byte != b"\n":
+                    newlines += 1
+                
+                print(f"      ✓ Complete: {base} - Total processed: {bytes_processed / (1024**3):.2f} GB")
+                total_reads += newlines // 4
+    finally:
+        stop.set()
+        producer.join()
     
     return total_reads
@@ -0,0 +1,25 @@
+import functools
+import io
+
+import pytest
+
+from v2.fastq_combiner.utils import BgzfWriter
+
+def pytest_configure(config):
+    config.addinivalue_line("markers", "slow: slow or serial-only test; deselect with -m 'not slow'")
+
+@pytest.fixture(scope="session")
+def synthetic_fastq_bytes():
+    """Synthetic FASTQ payloads keyed by read count, built (and deflated) once per session"""
+    @functools.lru_cache(maxsize=None)
+    def build(num_reads=10, compressed=True):
+        data = b"".join(b"@SEQ_ID_%d\nACGTACGTACGT\n+\nFFFFFFFFFFFF\n" % i for i in range(num_reads))
+        if not compressed:
+            return data
+        # BGZF (independent 64 KiB gzip members) like sequencer output, so block-parallel decoding is exercised;
+        # level 1 because fixtures are throwaway and deflate speed matters more than ratio
+        buf = io.BytesIO()
+        with BgzfWriter(buf, compresslevel=1) as writer:
+            writer.write(data)
+        return buf.getvalue()
+    return build
@@ -1,25 +1,44 @@
+import contextlib
 import gzip
+import hashlib
+import io
+import logging
 import os
-from v2.fastq_combiner.utils import count_reads_fastq
-import subprocess
+import shutil
+from v2.fastq_combiner import utils
+from v2.fastq_combiner.utils import count_reads_fastq, count_uniform_reads, combine_fastq_files, is_bgzf
+import fastq_combiner
+from fastq_combiner import main, fuzzy_match_sample, fuzzy_match_samples, read_output_meta, write_output_meta
+import pytest
+import threading
 import time
 import stat
+import struct
+import zlib
 
-def generate_synthetic_fastq(path, num_reads=10):
-    opener = gzip.open if str(path).endswith('.gz') else open
-    with opener(path, "wt") as f:
-        for i in range(num_reads):
-            f.write(f"@SEQ_ID_{i}\n")
-            f.write("ACGTACGTACGT\n")
-            f.write("+\n")
-            f.write("FFFFFFFFFFFF\n")
+def run_cli(caplog, *args):
+    """Run the v1 CLI in this process (no interpreter startup per call) and return its log and console output"""
+    caplog.set_level(logging.INFO)
+    # Console output (print, tqdm progress) goes to a StringIO rather than pytest's capture files
+    console = io.StringIO()
+    with contextlib.redirect_stdout(console), contextlib.redirect_stderr(console):
+        main([str(arg) for arg in args])
+    return caplog.text + console.getvalue()
 
-def test_count_reads_fastq(tmp_path):
+def has_fastq_output(directory):
+    """True if directory holds any .fastq.gz; scandir stops at the first hit without building Path objects"""
+    if not directory.is_dir():
+        return False
+    with os.scandir(directory) as entries:
+        return any(entry.name.endswith(".fastq.gz") for entry in entries)
+
+def test_count_reads_fastq(tmp_path, synthetic_fastq_bytes):
     # Generate R1 and R2 synthetic FASTQ
     r1_path = tmp_path / "TestSample_R1.fastq.gz"
     r2_path = tmp_path / "TestSample_R2.fastq.gz"
-    generate_synthetic_fastq(r1_path, num_reads=15)
-    generate_synthetic_fastq(r2_path, num_reads=15)
+    r1_path.write_bytes(synthetic_fastq_bytes(15))
+    # Identical mate: copy the bytes (sendfile on Linux) rather than writing them again
+    shutil.copyfile(r1_path, r2_path)
 
     r1_count = count_reads_fastq(str(r1_path))
     r2_count = count_reads_fastq(str(r2_path))
@@ -30,15 +49,74 @@ def test_count_reads_fastq(tmp_path):
     assert r1_count == 15
     assert r2_count == 15
 
+def pack_bgzf(data, block_size=60000):
+    """BGZF built by hand from the SAM spec (header, raw deflate, CRC32, ISIZE), independent of BgzfWriter"""
+    blocks = []
+    for start in range(0, len(data), block_size):
+        chunk = data[start:start + block_size]
+        deflate = zlib.compressobj(1, zlib.DEFLATED, -15)
+        cdata = deflate.compress(chunk) + deflate.flush()
+        header = struct.pack("<4BI2BH2BHH", 0x1F, 0x8B, 8, 4, 0, 0, 0xFF, 6, ord("B"), ord("C"), 2, len(cdata) + 25)
+        blocks.append(header + cdata + struct.pack("<II", zlib.crc32(chunk), len(chunk)))
+    # Empty EOF block
+    blocks.append(bytes.fromhex("1f8b08040000000000ff0600424302001b0003000000000000000000"))
+    return b"".join(blocks)
+
+def test_count_reads_bgzf_input(tmp_path, synthetic_fastq_bytes):
+    # Synthetic inputs are BGZF: several independent members, each tagged with its block size
+    data = synthetic_fastq_bytes(5000, compressed=False)
+    r1_path = tmp_path / "BgzfIn_R1.fastq.gz"
+    r1_path.write_bytes(synthetic_fastq_bytes(5000))
+    packed_path = tmp_path / "Packed_R1.fastq.gz"
+    packed_path.write_bytes(pack_bgzf(data))
+    plain_path = tmp_path / "Plain_R1.fastq.gz"
+    plain_path.write_bytes(gzip.compress(data))
+    assert is_bgzf(str(r1_path))
+    assert is_bgzf(str(packed_path))
+    assert not is_bgzf(str(plain_path))
+    # The fixture writer must agree with the hand-packed reference
+    assert gzip.decompress(r1_path.read_bytes()) == gzip.decompress(packed_path.read_bytes()) == data
+    assert utils.bgzf_decompressed_size(str(packed_path)) == len(data)
+    for path in (r1_path, packed_path, plain_path):
+        assert count_reads_fastq(str(path)) == 5000
+        assert count_reads_fastq(str(path), uniform_records=True) == 5000
+
+def test_count_reads_uniform_records(tmp_path, synthetic_fastq_bytes):
+    # Reads 0-9 share one record length, so the size shortcut applies; SEQ_ID_10+ are a byte longer
+    uniform_path = tmp_path / "Uniform_R1.fastq.gz"
+    uniform_path.write_bytes(synthetic_fastq_bytes(10))
+    mixed_path = tmp_path / "Mixed_R1.fastq.gz"
+    mixed_path.write_bytes(synthetic_fastq_bytes(15))
+    assert count_uniform_reads(str(uniform_path)) == 10
+    assert count_uniform_reads(str(mixed_path)) is None
+    assert count_reads_fastq(str(mixed_path), uniform_records=True) == 15
+
+def test_decompressed_size_multi_member_gzip(tmp_path, synthetic_fastq_bytes):
+    # The trailer ISIZE describes only the last member; the size must cover every member
+    data = synthetic_fastq_bytes(10, compressed=False)
+    multi_path = tmp_path / "Multi_R1.fastq.gz"
+    multi_path.write_bytes(gzip.compress(data) + gzip.compress(data * 2))
+    assert utils.get_decompressed_size(str(multi_path)) == 3 * len(data)
+    bgzf_path = tmp_path / "MultiBgzf_R1.fastq.gz"
+    bgzf_path.write_bytes(synthetic_fastq_bytes(5000))
+    assert utils.get_decompressed_size(str(bgzf_path)) == len(synthetic_fastq_bytes(5000, compressed=False))
+
+def test_count_reads_uniform_records_multi_member_gzip(tmp_path, synthetic_fastq_bytes):
+    # Concatenated gzip (as combine_fastq_files writes) has one ISIZE per member, so no size shortcut
+    data = synthetic_fastq_bytes(10, compressed=False)
+    multi_path = tmp_path / "Multi_R1.fastq.gz"
+    multi_path.write_bytes(gzip.compress(data) + gzip.compress(data))
+    assert count_uniform_reads(str(multi_path)) is None
+    assert count_reads_fastq(str(multi_path), uniform_records=True) == 20
+
 def test_empty_fastq(tmp_path):
     # Generate empty R1 and R2 FASTQ files
     r1_path = tmp_path / "EmptySample_R1.fastq.gz"
     r2_path = tmp_path / "EmptySample_R2.fastq.gz"
-    with gzip.open(r1_path, "wt") as f:
+    with gzip.open(r1_path, "wt", compresslevel=1) as f:
         pass
-    with gzip.open(r2_path, "wt") as f:
+    with gzip.open(r2_path, "wt", compresslevel=1) as f:
         pass
-    from v2.fastq_combiner.utils import count_reads_fastq
     r1_count = count_reads_fastq(str(r1_path))
     r2_count = count_reads_fastq(str(r2_path))
     assert r1_count == 0
@@ -47,95 +125,142 @@ def test_empty_fastq(tmp_path):
 def test_corrupt_fastq(tmp_path):
     # Create a corrupt/truncated FASTQ file (incomplete record)
     r1_path = tmp_path / "CorruptSample_R1.fastq.gz"
-    with gzip.open(r1_path, "wt") as f:
+    with gzip.open(r1_path, "wt", compresslevel=1) as f:
         f.write("@SEQ_ID_1\nACGTACGTACGT\n+\nFFFFFFFFFFFF\n")  # complete record
         f.write("@SEQ_ID_2\nACGTACGTACGT\n+\n")  # incomplete record (missing quality)
-    from v2.fastq_combiner.utils import count_reads_fastq
     r1_count = count_reads_fastq(str(r1_path))
     # Should count only the complete record
     assert r1_count == 1
 
-def test_missing_r2(tmp_path):
+def test_missing_r2(tmp_path, synthetic_fastq_bytes):
     # Create an R1 file without a corresponding R2 file
     r1_path = tmp_path / "LoneSample_R1.fastq.gz"
-    generate_synthetic_fastq(r1_path, num_reads=10)
+    r1_path.write_bytes(synthetic_fastq_bytes(10))
     # Don't create the R2 file
-    from v2.fastq_combiner.utils import count_reads_fastq
     r1_count = count_reads_fastq(str(r1_path))
     assert r1_count == 10
     # The file discovery logic should not include this R1 file since it has no R2 pair
     # This test verifies that the R1 file exists and is readable, but would be excluded
     # from the final file pairs due to missing R2
 
-def test_mismatched_read_counts(tmp_path):
+def test_mismatched_read_counts(tmp_path, synthetic_fastq_bytes):
     # Create R1 and R2 files with different numbers of reads
     r1_path = tmp_path / "MismatchSample_R1.fastq.gz"
     r2_path = tmp_path / "MismatchSample_R2.fastq.gz"
-    generate_synthetic_fastq(r1_path, num_reads=15)
-    generate_synthetic_fastq(r2_path, num_reads=10)  # Different count
-    from v2.fastq_combiner.utils import count_reads_fastq
+    r1_path.write_bytes(synthetic_fastq_bytes(15))
+    r2_path.write_bytes(synthetic_fastq_bytes(10))  # Different count
     r1_count = count_reads_fastq(str(r1_path))
     r2_count = count_reads_fastq(str(r2_path))
     assert r1_count == 15
     assert r2_count == 10
     assert r1_count != r2_count  # Verify they are indeed mismatched
 
-def test_dry_run_no_output(tmp_path):
+def test_combine_concatenates_gzip_members(tmp_path, synthetic_fastq_bytes):
+    # Gzipped sources are appended as raw gzip members, not recompressed
+    r1_path1 = tmp_path / "ConcatA_R1.fastq.gz"
+    r1_path2 = tmp_path / "ConcatB_R1.fastq.gz"
+    r1_path1.write_bytes(synthetic_fastq_bytes(4))
+    r1_path2.write_bytes(synthetic_fastq_bytes(6))
+    out_path = tmp_path / "Concat_R1.fastq.gz"
+    total = combine_fastq_files([str(r1_path1), str(r1_path2)], str(out_path))
+    assert total == 10
+    assert out_path.read_bytes() == r1_path1.read_bytes() + r1_path2.read_bytes()
+    assert count_reads_fastq(str(out_path)) == 10
+
+def test_append_file_finishes_short_kernel_copy(tmp_path, monkeypatch, synthetic_fastq_bytes):
+    # A copier that stops after 100 bytes must not leave a truncated output behind
+    def short_copier(in_fd, out_fd, offset, count):
+        return os.write(out_fd, os.pread(in_fd, min(count, 100), offset)) if offset == 0 else 0
+    monkeypatch.setattr(utils, "_kernel_copiers", lambda: [short_copier])
+    src_path = tmp_path / "Short_R1.fastq.gz"
+    src_path.write_bytes(synthetic_fastq_bytes(5000))
+    out_path = tmp_path / "ShortOut_R1.fastq.gz"
+    with open(out_path, "wb") as out_f:
+        utils.append_file(out_f, str(src_path), buffer_size=4096)
+    assert out_path.read_bytes() == src_path.read_bytes()
+
+def test_combine_counts_reads_while_copying(tmp_path, synthetic_fastq_bytes):
+    # Plain sources go through the decode/recompress path and are counted in the copy loop
+    r1_path1 = tmp_path / "CountA_R1.fastq"
+    r1_path2 = tmp_path / "CountB_R1.fastq"
+    r1_path1.write_bytes(synthetic_fastq_bytes(3, compressed=False))
+    with open(r1_path2, "w") as f:
+        f.write("@SEQ_ID_0\nACGTACGTACGT\n+\nFFFFFFFFFFFF\n")
+        f.write("@SEQ_ID_1\nACGTACGTACGT\n+\nFFFFFFFFFFFF")  # no trailing newline
+    out_path = tmp_path / "Count_R1.fastq.gz"
+    total = combine_fastq_files([str(r1_path1), str(r1_path2)], str(out_path), buffer_size=16)
+    assert total == 5
+
+def test_combine_writes_bgzf_blocks(tmp_path, synthetic_fastq_bytes):
+    # BGZF output is still plain gzip to readers, but every member carries its 'BC' block size
+    r1_path = tmp_path / "Bgzf_R1.fastq.gz"
+    r1_path.write_bytes(synthetic_fastq_bytes(5000))
+    out_path = tmp_path / "BgzfOut_R1.fastq.gz"
+    total = combine_fastq_files([str(r1_path)], str(out_path), output_format="bgzf")
+    assert total == 5000
+    data = out_path.read_bytes()
+    assert gzip.decompress(data) == gzip.decompress(r1_path.read_bytes())
+    offset = blocks = 0
+    while offset < len(data):
+        assert data[offset + 12:offset + 14] == b"BC"
+        offset += int.from_bytes(data[offset + 16:offset + 18], "little") + 1
+        blocks += 1
+    assert offset == len(data) and blocks > 2
+
+def test_dry_run_no_output(tmp_path, synthetic_fastq_bytes, caplog):
     # Create synthetic FASTQ files
     r1_path = tmp_path / "DryRunSample_R1.fastq.gz"
     r2_path = tmp_path / "DryRunSample_R2.fastq.gz"
-    generate_synthetic_fastq(r1_path, num_reads=5)
-    generate_synthetic_fastq(r2_path, num_reads=5)
+    r1_path.write_bytes(synthetic_fastq_bytes(5))
+    shutil.copyfile(r1_path, r2_path)
     # Create mapping CSV
     mapping_csv = tmp_path / "mapping.csv"
     with open(mapping_csv, "w") as f:
         f.write(f"DryRunSample,{r1_path},{r2_path}\n")
     # Run the script with --dry-run
     output_dir = tmp_path / "dryrun_output"
-    result = subprocess.run([
-        "python3", "fastq_combiner.py", str(mapping_csv), "-o", str(output_dir), "--dry-run"
-    ], capture_output=True, text=True)
+    # Script should complete without error (a failure exits via SystemExit)
+    run_cli(caplog, mapping_csv, "-o", output_dir, "--dry-run")
     # No output files should be created
-    assert not any(output_dir.glob("*.fastq.gz")), "No output files should be created in dry run mode"
-    # Script should complete without error
-    assert result.returncode == 0
+    assert not has_fastq_output(output_dir), "No output files should be created in dry run mode"
 
-def test_overwrite_protection(tmp_path):
+def test_overwrite_protection(tmp_path, synthetic_fastq_bytes, caplog):
     # Create synthetic FASTQ files
     r1_path = tmp_path / "OverwriteSample_R1.fastq.gz"
     r2_path = tmp_path / "OverwriteSample_R2.fastq.gz"
-    generate_synthetic_fastq(r1_path, num_reads=5)
-    generate_synthetic_fastq(r2_path, num_reads=5)
+    r1_path.write_bytes(synthetic_fastq_bytes(5))
+    shutil.copyfile(r1_path, r2_path)
     # Create mapping CSV
     mapping_csv = tmp_path / "mapping.csv"
     with open(mapping_csv, "w") as f:
         f.write(f"OverwriteSample,{r1_path},{r2_path}\n")
     # Run the script to generate output files
     output_dir = tmp_path / "overwrite_output"
-    subprocess.run([
-        "python3", "fastq_combiner.py", str(mapping_csv), "-o", str(output_dir), "--search-dirs", str(tmp_path), "--force"
-    ], check=True)
+    run_cli(caplog, mapping_csv, "-o", output_dir, "--search-dirs", tmp_path, "--force")
     r1_out = output_dir / "OverwriteSample_S1_R1_001.fastq.gz"
     r2_out = output_dir / "OverwriteSample_S1_R2_001.fastq.gz"
     assert r1_out.exists() and r2_out.exists()
-    # Record modification times
+    # Backdate the outputs so a rewrite would be visible without waiting for the mtime tick
+    past = time.time() - 10
+    os.utime(r1_out, (past, past))
+    os.utime(r2_out, (past, past))
     r1_mtime_before = r1_out.stat().st_mtime
     r2_mtime_before = r2_out.stat().st_mtime
-    time.sleep(1)  # Ensure mtime would change if overwritten
     # Run the script again without --force
-    subprocess.run([
-        "python3", "fastq_combiner.py", str(mapping_csv), "-o", str(output_dir), "--search-dirs", str(tmp_path)
-    ], check=True)
+    run_cli(caplog, mapping_csv, "-o", output_dir, "--search-dirs", tmp_path)
     # Modification times should not change
     assert r1_out.stat().st_mtime == r1_mtime_before
     assert r2_out.stat().st_mtime == r2_mtime_before
 
-def test_permission_error(tmp_path):
+@pytest.mark.slow
+@pytest.mark.skipif(os.name != "posix", reason="chmod(0) requires POSIX permissions")
+@pytest.mark.skipif(hasattr(os, "geteuid") and os.geteuid() == 0, reason="root can read files regardless of mode")
+def test_permission_error(tmp_path, synthetic_fastq_bytes, caplog):
     # Create a synthetic FASTQ file
     r1_path = tmp_path / "NoPermSample_R1.fastq.gz"
     r2_path = tmp_path / "NoPermSample_R2.fastq.gz"
-    generate_synthetic_fastq(r1_path, num_reads=5)
-    generate_synthetic_fastq(r2_path, num_reads=5)
+    r1_path.write_bytes(synthetic_fastq_bytes(5))
+    shutil.copyfile(r1_path, r2_path)
     # Remove read permissions from R1
     r1_path.chmod(0)
     # Create mapping CSV
@@ -144,56 +269,124 @@ def test_permission_error(tmp_path):
         f.write(f"NoPermSample,{r1_path},{r2_path}\n")
     # Run the script (should log an error and skip the file)
     output_dir = tmp_path / "noperm_output"
-    result = subprocess.run([
-        "python3", "fastq_combiner.py", str(mapping_csv), "-o", str(output_dir), "--search-dirs", str(tmp_path)
-    ], capture_output=True, text=True)
-    # Restore permissions for cleanup
-    r1_path.chmod(stat.S_IRUSR | stat.S_IWUSR)
+    try:
+        log = run_cli(caplog, mapping_csv, "-o", output_dir, "--search-dirs", tmp_path)
+    except SystemExit:
+        log = caplog.text
+    finally:
+        # Restore permissions for cleanup
+        r1_path.chmod(stat.S_IRUSR | stat.S_IWUSR)
     # Should log an error about unreadable file
-    assert "Error" in result.stdout or "error" in result.stderr or "unreadable" in result.stdout.lower()
+    assert "error" in log.lower() or "unreadable" in log.lower()
     # No output files should be created
-    assert not any(output_dir.glob("*.fastq.gz")), "No output files should be created if input is unreadable"
+    assert not has_fastq_output(output_dir), "No output files should be created if input is unreadable"
 
-def test_paired_end_deduplication(tmp_path):
+def test_paired_end_deduplication(tmp_path, synthetic_fastq_bytes, caplog):
     # Create synthetic FASTQ files with duplicate reads
     r1_path1 = tmp_path / "Sample1_R1.fastq.gz"
     r2_path1 = tmp_path / "Sample1_R2.fastq.gz"
     r1_path2 = tmp_path / "Sample2_R1.fastq.gz"
     r2_path2 = tmp_path / "Sample2_R2.fastq.gz"
     # Both samples have the same reads (simulate duplicates)
-    generate_synthetic_fastq(r1_path1, num_reads=5)
-    generate_synthetic_fastq(r2_path1, num_reads=5)
-    generate_synthetic_fastq(r1_path2, num_reads=5)
-    generate_synthetic_fastq(r2_path2, num_reads=5)
+    r1_path1.write_bytes(synthetic_fastq_bytes(5))
+    # Identical content, so hard-link one file instead of writing four
+    for path in (r2_path1, r1_path2, r2_path2):
+        os.link(r1_path1, path)
     # Create mapping CSV
     mapping_csv = tmp_path / "mapping.csv"
     with open(mapping_csv, "w") as f:
         f.write(f"DedupSample,{r1_path1},{r1_path2}\n")
     # Run the script with paired-end deduplication
     output_dir = tmp_path / "dedup_output"
-    subprocess.run([
-        "python3", "fastq_combiner.py", str(mapping_csv), "-o", str(output_dir), "--search-dirs", str(tmp_path), "--deduplicate", "--paired-end-dedup", "--force"
-    ], check=True)
+    run_cli(caplog, mapping_csv, "-o", output_dir, "--search-dirs", tmp_path, "--deduplicate", "--paired-end-dedup", "--force")
     r1_out = output_dir / "DedupSample_S1_R1_001.fastq.gz"
     r2_out = output_dir / "DedupSample_S1_R2_001.fastq.gz"
     # Only 1 unique read pair should remain (since all reads are identical)
-    from v2.fastq_combiner.utils import count_reads_fastq
     assert count_reads_fastq(str(r1_out)) == 1
     assert count_reads_fastq(str(r2_out)) == 1
 
-def test_checksum_and_error_reporting(tmp_path):
+def test_process_executor_multiple_targets(tmp_path, synthetic_fastq_bytes, caplog):
+    # Two targets on a process pool: process_target and the IO semaphore initializer must cross processes
+    mapping_csv = tmp_path / "mapping.csv"
+    lines = []
+    for name, num_reads in (("ProcA", 3), ("ProcB", 6)):
+        r1_path = tmp_path / f"{name}_R1.fastq.gz"
+        r1_path.write_bytes(synthetic_fastq_bytes(num_reads))
+        shutil.copyfile(r1_path, tmp_path / f"{name}_R2.fastq.gz")
+        lines.append(f"{name}Combined,{r1_path}\n")
+    mapping_csv.write_text("".join(lines))
+    output_dir = tmp_path / "process_output"
+    log = run_cli(caplog, mapping_csv, "-o", output_dir, "--search-dirs", tmp_path, "--force",
+                  "--executor", "process", "--threads", "2", "--io-concurrency", "1")
+    assert "Executor: process pool with 2 workers" in log
+    for name, num_reads in (("ProcA", 3), ("ProcB", 6)):
+        assert count_reads_fastq(str(output_dir / f"{name}Combined_S1_R1_001.fastq.gz")) == num_reads
+        assert count_reads_fastq(str(output_dir / f"{name}Combined_S1_R2_001.fastq.gz")) == num_reads
+
+def test_io_concurrency_bounds_opens_not_targets(tmp_path, synthetic_fastq_bytes, caplog, monkeypatch):
+    # With one IO slot, two targets must still stream at the same time: each reader's first readline
+    # waits for the other target's, which deadlocks (and breaks the barrier) if the slot is held while parsing
+    real_open = fastq_combiner.open_fastq_text
+    barrier = threading.Barrier(2, timeout=10)
+    lock = threading.Lock()
+    opening = []
+    peak = []
+
+    class BarrierReader:
+        def __init__(self, handle):
+            self.handle = handle
+            self.buffer = handle.buffer
+            self.waited = False
+        def readline(self):
+            if not self.waited:
+                self.waited = True
+                barrier.wait()
+            return self.handle.readline()
+        def close(self):
+            self.handle.close()
+        def __enter__(self):
+            return self
+        def __exit__(self, *exc):
+            self.handle.close()
+
+    def tracking_open(fastq_file, buffer_size=fastq_combiner.READ_BUFFER_SIZE):
+        with lock:
+            opening.append(fastq_file)
+            peak.append(len(opening))
+        time.sleep(0.05)
+        with lock:
+            opening.remove(fastq_file)
+        return BarrierReader(real_open(fastq_file, buffer_size))
+
+    monkeypatch.setattr(fastq_combiner, "open_fastq_text", tracking_open)
+    mapping_csv = tmp_path / "mapping.csv"
+    lines = []
+    for name in ("GateA", "GateB"):
+        r1_path = tmp_path / f"{name}_R1.fastq.gz"
+        r1_path.write_bytes(synthetic_fastq_bytes(4))
+        shutil.copyfile(r1_path, tmp_path / f"{name}_R2.fastq.gz")
+        lines.append(f"{name}Combined,{r1_path}\n")
+    mapping_csv.write_text("".join(lines))
+    output_dir = tmp_path / "gate_output"
+    run_cli(caplog, mapping_csv, "-o", output_dir, "--search-dirs", tmp_path, "--force",
+            "--executor", "thread", "--threads", "2", "--io-concurrency", "1")
+    assert max(peak) == 1
+    assert not barrier.broken
+    for name in ("GateA", "GateB"):
+        assert count_reads_fastq(str(output_dir / f"{name}Combined_S1_R1_001.fastq.gz")) == 4
+        assert count_reads_fastq(str(output_dir / f"{name}Combined_S1_R2_001.fastq.gz")) == 4
+
+def test_checksum_and_error_reporting(tmp_path, synthetic_fastq_bytes, caplog):
     # Create synthetic FASTQ files
     r1_path = tmp_path / "CSVSamp_R1.fastq.gz"
     r2_path = tmp_path / "CSVSamp_R2.fastq.gz"
-    generate_synthetic_fastq(r1_path, num_reads=3)
-    generate_synthetic_fastq(r2_path, num_reads=3)
+    r1_path.write_bytes(synthetic_fastq_bytes(3))
+    shutil.copyfile(r1_path, r2_path)
     mapping_csv = tmp_path / "mapping.csv"
     with open(mapping_csv, "w") as f:
         f.write(f"CSVSamp,{r1_path},{r2_path}\n")
     output_dir = tmp_path / "csv_output"
-    subprocess.run([
-        "python3", "fastq_combiner.py", str(mapping_csv), "-o", str(output_dir), "--search-dirs", str(tmp_path), "--force"
-    ], check=True)
+    run_cli(caplog, mapping_csv, "-o", output_dir, "--search-dirs", tmp_path, "--force")
     # Check CSV summary for checksums and no errors
     csv_summary = output_dir / "combination_summary.csv"
     with open(csv_summary) as f:
@@ -208,94 +401,129 @@ def test_checksum_and_error_reporting(tmp_path):
     assert skipped_col == 'false'
     assert error_col == ''
 
-def test_quality_score_format_detection(tmp_path):
-    # Create a FASTQ file with Sanger quality scores
-    r1_path = tmp_path / "QualSample_R1.fastq"
-    with open(r1_path, "w") as f:
-        for i in range(5):
-            f.write(f"@SEQ_ID_{i}\nACGTACGTACGT\n+\n!!!!!#####\n")  # ASCII 33-35
-    r2_path = tmp_path / "QualSample_R2.fastq"
-    with open(r2_path, "w") as f:
-        for i in range(5):
-            f.write(f"@SEQ_ID_{i}\nACGTACGTACGT\n+\n!!!!!#####\n")
+def test_output_meta_round_trip_and_staleness(tmp_path):
+    out_path = tmp_path / "Meta_S1_R1_001.fastq.gz"
+    out_path.write_bytes(b"combined")
+    write_output_meta(str(out_path), "abc123")
+    assert read_output_meta(str(out_path))["md5"] == "abc123"
+    # A rewritten output no longer matches its sidecar's size/mtime
+    out_path.write_bytes(b"combined again")
+    assert read_output_meta(str(out_path)) is None
+    # A corrupt sidecar is ignored rather than raising
+    write_output_meta(str(out_path), "abc123")
+    (tmp_path / "Meta_S1_R1_001.fastq.gz.meta.json").write_text("{not json")
+    assert read_output_meta(str(out_path)) is None
+
+def test_rerun_reuses_sidecar_checksums(tmp_path, synthetic_fastq_bytes, caplog):
+    r1_path = tmp_path / "MetaSamp_R1.fastq.gz"
+    r2_path = tmp_path / "MetaSamp_R2.fastq.gz"
+    r1_path.write_bytes(synthetic_fastq_bytes(3))
+    shutil.copyfile(r1_path, r2_path)
     mapping_csv = tmp_path / "mapping.csv"
-    with open(mapping_csv, "w") as f:
-        f.write(f"QualSample,{r1_path},{r2_path}\n")
-    output_dir = tmp_path / "qual_output"
-    result = subprocess.run([
-        "python3", "fastq_combiner.py", str(mapping_csv), "-o", str(output_dir), "--search-dirs", str(tmp_path), "--validate", "--force"
-    ], capture_output=True, text=True)
-    # Should log detected quality format
-    assert "Detected quality format" in result.stdout or "Detected quality format" in result.stderr
-
-def test_paired_end_integrity_error(tmp_path):
+    mapping_csv.write_text(f"MetaSamp,{r1_path},{r2_path}\n")
+    output_dir = tmp_path / "meta_output"
+    run_cli(caplog, mapping_csv, "-o", output_dir, "--search-dirs", tmp_path, "--force")
+    r1_out = output_dir / "MetaSamp_S1_R1_001.fastq.gz"
+    r2_out = output_dir / "MetaSamp_S1_R2_001.fastq.gz"
+    assert read_output_meta(str(r1_out))["md5"] == hashlib.md5(r1_out.read_bytes()).hexdigest()
+    # Plant a marker checksum (size/mtime unchanged) to see whether the rerun reads the sidecar
+    write_output_meta(str(r1_out), "sidecar-md5")
+    write_output_meta(str(r2_out), "sidecar-md5")
+    # A stale R2 sidecar must fall back to hashing the file
+    past = time.time() - 10
+    os.utime(r2_out, (past, past))
+    run_cli(caplog, mapping_csv, "-o", output_dir, "--search-dirs", tmp_path)
+    with open(output_dir / "combination_summary.csv") as f:
+        columns = f.readlines()[1].strip().split(",")
+    assert columns[7] == "True"
+    assert columns[10] == "sidecar-md5"
+    assert columns[11] == hashlib.md5(r2_out.read_bytes()).hexdigest()
+
+def test_paired_end_integrity_error(tmp_path, synthetic_fastq_bytes, caplog):
     # Create R1 and R2 with mismatched reads
     r1_path = tmp_path / "PEInt_R1.fastq.gz"
     r2_path = tmp_path / "PEInt_R2.fastq.gz"
-    generate_synthetic_fastq(r1_path, num_reads=5)
-    generate_synthetic_fastq(r2_path, num_reads=3)
+    r1_path.write_bytes(synthetic_fastq_bytes(5))
+    r2_path.write_bytes(synthetic_fastq_bytes(3))
     mapping_csv = tmp_path / "mapping.csv"
     with open(mapping_csv, "w") as f:
         f.write(f"PEInt,{r1_path},{r2_path}\n")
     output_dir = tmp_path / "peint_output"
-    result = subprocess.run([
-        "python3", "fastq_combiner.py", str(mapping_csv), "-o", str(output_dir), "--search-dirs", str(tmp_path)
-    ], capture_output=True, text=True)
+    log = run_cli(caplog, mapping_csv, "-o", output_dir, "--search-dirs", tmp_path)
     # Should log a paired-end mismatch warning or error
-    assert "paired-end" in result.stdout.lower() or "paired-end" in result.stderr.lower()
-
-def test_adapter_and_gc_analysis(tmp_path):
-    # Create FASTQ with known adapter and GC content
-    r1_path = tmp_path / "GCAdapter_R1.fastq"
-    r2_path = tmp_path / "GCAdapter_R2.fastq"
-    with open(r1_path, "w") as f:
-        for i in range(5):
-            f.write(f"@SEQ_ID_{i}\nACGTACGTACGTAGATCGGAAGAGC\n+\nFFFFFFFFFFFFFFFFFFFFF\n")  # Adapter
-    with open(r2_path, "w") as f:
-        for i in range(5):
-            f.write(f"@SEQ_ID_{i}\nGCGCGCGCGCGC\n+\nFFFFFFFFFFFF\n")
-    mapping_csv = tmp_path / "mapping.csv"
-    with open(mapping_csv, "w") as f:
-        f.write(f"GCAdapter,{r1_path},{r2_path}\n")
-    output_dir = tmp_path / "gc_adapter_output"
-    result = subprocess.run([
-        "python3", "fastq_combiner.py", str(mapping_csv), "-o", str(output_dir), "--search-dirs", str(tmp_path), "--adapter-check", "--gc-analysis", "--force"
-    ], capture_output=True, text=True)
-    # Should log adapter detection and GC content
-    assert "adapter" in result.stdout.lower() or "adapter" in result.stderr.lower()
-    assert "gc content" in result.stdout.lower() or "gc content" in result.stderr.lower()
-
-def test_fuzzy_matching(tmp_path):
+    assert "paired-end" in log.lower()
+
+def test_fuzzy_matching(tmp_path, synthetic_fastq_bytes, caplog):
     # Create FASTQ files with slightly different sample names
     r1_path = tmp_path / "FuzzySample_R1.fastq.gz"
     r2_path = tmp_path / "FuzzySample_R2.fastq.gz"
-    generate_synthetic_fastq(r1_path, num_reads=2)
-    generate_synthetic_fastq(r2_path, num_reads=2)
+    r1_path.write_bytes(synthetic_fastq_bytes(2))
+    shutil.copyfile(r1_path, r2_path)
     mapping_csv = tmp_path / "mapping.csv"
     # Intentionally typo in mapping
     with open(mapping_csv, "w") as f:
         f.write(f"FuzzySampel,{r1_path},{r2_path}\n")
     output_dir = tmp_path / "fuzzy_output"
-    result = subprocess.run([
-        "python3", "fastq_combiner.py", str(mapping_csv), "-o", str(output_dir), "--search-dirs", str(tmp_path), "--force"
-    ], capture_output=True, text=True)
+    log = run_cli(caplog, mapping_csv, "-o", output_dir, "--search-dirs", tmp_path, "--force")
     # Should log a fuzzy match
-    assert "fuzzy match" in result.stdout.lower() or "fuzzy match" in result.stderr.lower()
+    assert "fuzzy match" in log.lower()
 
-def test_dry_run_all_features(tmp_path):
-    # Create synthetic FASTQ files
-    r1_path = tmp_path / "DryAll_R1.fastq.gz"
-    r2_path = tmp_path / "DryAll_R2.fastq.gz"
-    generate_synthetic_fastq(r1_path, num_reads=2)
-    generate_synthetic_fastq(r2_path, num_reads=2)
-    mapping_csv = tmp_path / "mapping.csv"
-    with open(mapping_csv, "w") as f:
-        f.write(f"DryAll,{r1_path},{r2_path}\n")
-    output_dir = tmp_path / "dryall_output"
-    result = subprocess.run([
-        "python3", "fastq_combiner.py", str(mapping_csv), "-o", str(output_dir), "--search-dirs", str(tmp_path), "--dry-run", "--deduplicate", "--paired-end-dedup", "--validate", "--adapter-check", "--gc-analysis"
-    ], capture_output=True, text=True)
-    # Should not create any output files
-    assert not any(output_dir.glob("*.fastq.gz")), "No output files should be created in dry run mode"
-    # Should log dry run
-    assert "dry run" in result.stdout.lower() or "dry run" in result.stderr.lower()
+def test_fuzzy_match_rejects_sibling_samples():
+    pytest.importorskip("rapidfuzz")
+    donors = ["PBMC_Donor_10", "PBMC_Donor_11", "PBMC_Donor_12"]
+    # A missing donor or replicate must not be filled in with a neighbour's reads
+    assert fuzzy_match_sample("PBMC_Donor_13", donors) is None
+    assert fuzzy_match_sample("Tumor_Rep1_L001", ["Tumor_Rep2_L001"]) is None
+    # Equally close candidates are ambiguous
+    assert fuzzy_match_sample("SampleNameAB", ["SampleNameAC", "SampleNameAD"]) is None
+    # A typo with the right number still resolves
+    assert fuzzy_match_sample("PBMC_Donr_12", donors) == "PBMC_Donor_12"
+
+def cdist_without_numpy(queries, choices, scorer, processor, score_cutoff, workers):
+    """rapidfuzz cdist as nested lists, so the batched loop runs even where numpy is missing"""
+    rows = []
+    for query in queries:
+        scores = [scorer(processor(query), processor(choice)) for choice in choices]
+        rows.append([score if score >= score_cutoff else 0 for score in scores])
+    return rows
+
+@pytest.mark.parametrize("batched", ["cdist", "fallback"])
+def test_fuzzy_match_samples_rejects_sibling_samples(monkeypatch, batched):
+    pytest.importorskip("rapidfuzz")
+    if batched == "cdist":
+        monkeypatch.setattr(fastq_combiner.rfprocess, "cdist", cdist_without_numpy)
+    else:
+        def no_numpy(*args, **kwargs):
+            raise ImportError("numpy")
+        monkeypatch.setattr(fastq_combiner.rfprocess, "cdist", no_numpy)
+    available = ["PBMC_Donor_10", "PBMC_Donor_11", "PBMC_Donor_12", "Tumor_Rep2_L001",
+                 "SampleNameAC", "SampleNameAD"]
+    resolved = fuzzy_match_samples(["PBMC_Donor_13", "Tumor_Rep1_L001", "SampleNameAB", "PBMC_Donr_12"], available)
+    assert resolved == {"PBMC_Donr_12": "PBMC_Donor_12"}
+
+@pytest.fixture(scope="module")
+def cli_mapping(tmp_path_factory):
+    """One plain-FASTQ sample (Sanger qualities, Illumina adapter in R1) shared by the CLI matrix"""
+    input_dir = tmp_path_factory.mktemp("cli_inputs")
+    r1_path = input_dir / "CliSample_R1.fastq"
+    r2_path = input_dir / "CliSample_R2.fastq"
+    r1_path.write_bytes(b"".join(b"@SEQ_ID_%d\nACGTACGTACGTAGATCGGAAGAGC\n+\n!!!!!####################\n" % i for i in range(5)))
+    r2_path.write_bytes(b"".join(b"@SEQ_ID_%d\nGCGCGCGCGCGC\n+\n!!!!!#######\n" % i for i in range(5)))
+    mapping_csv = input_dir / "mapping.csv"
+    mapping_csv.write_text(f"CliSample,{r1_path},{r2_path}\n")
+    return mapping_csv
+
+@pytest.mark.parametrize("flags, expected", [
+    (["--validate", "--force"], ["detected quality format"]),
+    (["--validate-full", "--force"], ["detected quality format"]),
+    (["--adapter-check", "--gc-analysis", "--force"], ["adapter", "gc content"]),
+    (["--dry-run", "--deduplicate", "--paired-end-dedup", "--validate", "--adapter-check", "--gc-analysis"], ["dry run"]),
+], ids=["validate", "validate-full", "adapter-gc", "dry-run-all"])
+def test_cli_feature_logging(tmp_path, caplog, cli_mapping, flags, expected):
+    # Inputs are built once per module; each variant only gets its own output directory
+    output_dir = tmp_path / "cli_output"
+    log = run_cli(caplog, cli_mapping, "-o", output_dir, "--search-dirs", cli_mapping.parent, *flags).lower()
+    for text in expected:
+        assert text in log
+    if "--dry-run" in flags:
+        assert not has_fastq_output(output_dir), "No output files should be created in dry run mode"